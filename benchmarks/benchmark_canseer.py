@@ -0,0 +1,143 @@
+"""
+Benchmarks for the canseer loaders, filters, aggregations and maps.
+
+Run from anywhere with
+
+    python benchmarks/benchmark_canseer.py
+    python benchmarks/benchmark_canseer.py --scales 1 10 100 --repeat 5
+
+Each case reports the best and median wall time of --repeat runs and the
+peak memory allocated through Python (tracemalloc) in one further run.
+Provider frames come from canseer.synthetic with BASE_ROWS rows at scale 1,
+the loader reads a synthetic workbook written to a temporary directory and
+downloads are disabled, so the suite runs offline. Figures use the Agg
+backend.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import matplotlib
+matplotlib.use('Agg')
+
+# Import canseer from this checkout rather than an installed copy
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import matplotlib.pyplot as plt
+
+from canseer import download_cache
+from canseer.data_wrangling import (get_provider_data, filter_data,
+                                    proportion_breaches, proportion_breaches_by_series)
+from canseer.provider_index import ProviderIndex
+from canseer.synthetic import synthetic_provider_data
+from canseer.cancer_plotting import (read_shapefile, select_to_plot, plot_icb_map,
+                                     plot_map)
+
+# Rows of the 1x synthetic frame, the order of a year of provider data
+BASE_ROWS = 100000
+
+# Representative filter_data() filters
+FILTERS = {
+    'standard': {'standard': 'FDS'},
+    'standard+months': {'standard': 'RTT', 'start_month': '2022-10-01',
+                        'end_month': '2023-03-01'},
+    'org+cancer': {'standard': 'DTT', 'org': ['RWP', 'RXQ', 'RGT'],
+                   'cancer_type': ['Lung', 'Breast']},
+}
+
+
+def measure(func, repeat):
+    """Returns the wall times of repeat runs and the peak traced memory of one run."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+        plt.close('all')
+
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        plt.close('all')
+    return times, peak
+
+
+def benchmark_cases(scales, workbook):
+    """Yields (name, scale, func) for every case."""
+    yield 'get_provider_data', 'fixture', lambda: get_provider_data(workbook)
+
+    # ICB boundaries, dissolved from the SICBLs and cached once
+    gdf = read_shapefile()
+
+    for scale in scales:
+        df = synthetic_provider_data(n_rows=BASE_ROWS * scale)
+        index = ProviderIndex(df)
+        fds = filter_data(df, FILTERS['standard'])
+
+        for name, filters in FILTERS.items():
+            yield f'filter_data[{name}]', scale, lambda filters=filters: filter_data(df, filters)
+            yield (f'ProviderIndex.filter[{name}]', scale,
+                   lambda filters=filters: index.filter(filters))
+        yield 'ProviderIndex()', scale, lambda: ProviderIndex(df)
+        yield ('proportion_breaches', scale,
+               lambda: proportion_breaches(fds.copy(), window_size=3))
+        yield ('proportion_breaches_by_series[org_code]', scale,
+               lambda: proportion_breaches_by_series(fds, window_size=3, by=['org_code']))
+
+        yield ('select_to_plot', scale,
+               lambda: select_to_plot(df, gdf=gdf, filters={'standard': 'FDS'}))
+        yield ('plot_icb_map', scale,
+               lambda: plot_icb_map(df, {'standard': 'FDS'}, dpi=100))
+        for level in ['icb', 'sicbl']:
+            yield (f'plot_map[{level}]', scale,
+                   lambda level=level: plot_map(df, {'standard': 'FDS'},
+                                                level=level, dpi=100))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10],
+                        help='multiples of BASE_ROWS to benchmark (default 1 10)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs per case (default 3)')
+    parser.add_argument('--workbook-rows', type=int, default=20000,
+                        help='rows of the workbook read by get_provider_data (default 20000)')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        # Offline with an empty cache, geometry is cached on first use
+        download_cache.set_cache_dir(tmp)
+        download_cache.set_offline(True)
+
+        workbook = os.path.join(tmp, 'provider.xlsx')
+        synthetic_provider_data(n_rows=args.workbook_rows, xlsx_path=workbook)
+
+        print(f"{'case':<45} {'scale':>8} {'best s':>9} {'median s':>9} {'peak MB':>9}")
+        for name, scale, func in benchmark_cases(args.scales, workbook):
+            # Warm up caches (geometry, lookups) before timing
+            func()
+            times, peak = measure(func, args.repeat)
+            best, median = min(times), statistics.median(times)
+            print(f'{name:<45} {scale:>8} {best:>9.4f} {median:>9.4f} {peak / 1e6:>9.1f}')
+            results.append({'case': name, 'scale': scale, 'best_s': best,
+                            'median_s': median, 'peak_bytes': peak})
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
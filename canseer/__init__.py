@@ -0,0 +1,24 @@
+"""
+Canseer, a toolkit for NHS cancer waiting times data.
+
+Submodules are imported when first used, e.g. canseer.data_wrangling
+loads pandas and NumPy only, and matplotlib, plotly and geopandas are not
+imported until a plot or map is made.
+"""
+import importlib
+from canseer.version import __version__
+
+# Submodules available as attributes of the package (PEP 562)
+SUBMODULES = ['cancer_plotting', 'catalog', 'cube', 'data_wrangling',
+              'download_cache', 'geometry', 'instrumentation', 'provider_index',
+              'resources', 'snapshot', 'store', 'synthetic', 'trusts']
+
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        return importlib.import_module(f'canseer.{name}')
+    raise AttributeError(f"module 'canseer' has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + SUBMODULES)
@@ -0,0 +1,19 @@
+import importlib
+
+
+class LazyModule:
+    """
+    Stand-in for a module which is only imported when one of its attributes
+    is first used, e.g. plt = LazyModule('matplotlib.pyplot') at the top of
+    a module keeps matplotlib out of the import of that module.
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        # sys.modules caches the import, so later lookups are cheap
+        return getattr(importlib.import_module(self._name), attr)
+
+    def __repr__(self):
+        return f'<lazy module {self._name!r}>'
@@ -1,18 +1,47 @@
+import concurrent.futures
+import os
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import plotly.graph_objects as go
-import geopandas as gpd
-from matplotlib.colors import LinearSegmentedColormap
-from mpl_toolkits.axes_grid1 import make_axes_locatable
-from matplotlib.cm import ScalarMappable
-from matplotlib.colors import Normalize
+from canseer._lazy import LazyModule
 from canseer.data_wrangling import filter_data
-from canseer.data_wrangling import proportion_breaches
+from canseer.data_wrangling import proportion_breaches, proportion_breaches_by_series
 from canseer.data_wrangling import get_national_28_day_standard, get_national_31_day_standard, get_national_62_day_standard
+from canseer.data_wrangling import get_national_data, NATIONAL_DATA_LINK
 from canseer.data_wrangling import read_icb_sicb_coding, nhs_code_link
-
-
+from canseer.data_wrangling import attach_geography, geography_column
+from canseer.geometry import icb_geometry
+from canseer.geometry import map_geometry, map_geojson, tolerance_for_figure
+from canseer.geometry import MAP_LEVELS
+from canseer.instrumentation import stage
+
+# Plotting backends are imported on first use, so loading canseer for its
+# data functions does not pull in matplotlib or plotly
+plt = LazyModule('matplotlib.pyplot')
+mdates = LazyModule('matplotlib.dates')
+mcm = LazyModule('matplotlib.cm')
+mcollections = LazyModule('matplotlib.collections')
+mcolors = LazyModule('matplotlib.colors')
+mfigure = LazyModule('matplotlib.figure')
+mpatches = LazyModule('matplotlib.patches')
+mpath = LazyModule('matplotlib.path')
+axes_grid1 = LazyModule('mpl_toolkits.axes_grid1')
+go = LazyModule('plotly.graph_objects')
+plotly_colors = LazyModule('plotly.colors')
+
+
+# Proportion of breaches above which the NHS target for a standard is missed
+STANDARD_THRESHOLDS = {'FDS': 0.25, 'DTT': 0.04, 'RTT': 0.15}
+
+# Map level -> org_geography() column the provider data is aggregated to,
+# which is also the map_geometry() column the areas are matched on.
+# Trusts only resolve to ICBs, so SICBLs show the value of their ICB.
+LEVEL_DATA_COLUMNS = {'sicbl': 'ICB23NM', 'icb': 'ICB23NM', 'region': 'nhs_region'}
+
+# Map level -> name used in map titles
+LEVEL_NAMES = {'sicbl': 'Sub-ICB location', 'icb': 'ICB', 'region': 'NHS region'}
+
+
+@stage('plot_stacked_referrals')
 def plot_stacked_referrals(df, subgroups, labels, ncol, graph_title, y_label):
     """
     Returns stacked plot graph of number of referrals over time.
@@ -61,6 +90,7 @@ def plot_stacked_referrals(df, subgroups, labels, ncol, graph_title, y_label):
     plt.title(graph_title)
     return fig, ax
 
+@stage('prop_breaches_graph')
 def prop_breaches_graph(df, filters={'start_month': '05-2022',
                                      'end_month': '05-2022',
                                      'standard': 'FDS'}, labels=None):
@@ -138,76 +168,214 @@ def prop_breaches_graph(df, filters={'start_month': '05-2022',
     return fig, ax
 
 
-def breaches_animated_plot(data, filters, window_size=5):
+@stage('compare_orgs_plot')
+def compare_orgs_plot(data, orgs=None, icb=None, filters={'standard': 'FDS'},
+                      window_size=1, ncols=3, panel_size=(3, 2),
+                      national_data_link=NATIONAL_DATA_LINK):
     """
-    Create an animated plot with a moving average.
+    Small multiples of the proportion of breaches of several NHS trusts,
+    each panel with the national proportion for the same standard.
 
-    Parameters:
-    - data (pd.DataFrame): Input DataFrame containing relevant columns.
-    - filters (list): A list of tuples specifying filters to be applied.
-    - window_size (int): The size of the moving average window.
+    The provider data is filtered and aggregated once for all trusts, and
+    the national data is loaded and aggregated once for all panels.
 
-    Returns:
-    - None: The plot is displayed interactively.
-    """
+    Parameters
+    ----------
+    - data : DataFrame or ProviderIndex
+        Provider data, see filter_data().
+    - orgs : list, optional
+        Org codes of the trusts to compare, e.g. ['RWP', 'RXQ'].
+    - icb : str, optional
+        Compare every trust with data in an ICB, given as its 3-character
+        code (e.g. 'QHL'), 9-character ONS code or name. See org_geography().
+        Used when orgs is not given.
+    - filters : dict, optional
+        Filters applied to both datasets, see filter_data(). A single
+        'standard' is needed for the national comparison. An 'org' filter
+        is replaced by orgs or icb. Defaults to {'standard': 'FDS'}.
+    - window_size : int, optional
+        Number of months over which a moving average is taken, 1 plots the
+        monthly proportions. The default is 1.
+    - ncols : int, optional
+        Number of panels in each row. The default is 3.
+    - panel_size : tuple, optional
+        Width and height of each panel in inches. The default is (3, 2).
+    - national_data_link : str, optional
+        URL or local path of the national workbook, see get_national_data().
 
-    # Apply filters to the data
-    data = select_data(data, filters)
+    Returns
+    -------
+    - fig : matplotlib.figure.Figure
+    - axes : numpy.ndarray of matplotlib.axes.Axes
+        One panel per trust with data, in the order of orgs
+        (org code order for an ICB). Unused panels are hidden.
 
-    # Sort data by the 'PERIOD' column
-    data.sort_values(by='PERIOD', inplace=True)
+    Examples
+    --------
+    >>> compare_orgs_plot(data, orgs=['RWP', 'RXQ', 'RGT'],
+    ...                   filters={'standard': 'RTT'}, window_size=3)
+    >>> compare_orgs_plot(data, icb='NHS Cheshire and Merseyside '
+    ...                               'Integrated Care Board')
+    """
+    if orgs is None and icb is None:
+        raise ValueError('Give the trusts to compare with orgs or icb')
+    standard = filters.get('standard')
+    if not isinstance(standard, str):
+        raise ValueError('filters should select a single standard, e.g. '
+                         + "{'standard': 'FDS'}")
+
+    # One filtering and grouped aggregation for all trusts
+    provider_filters = {key: value for key, value in filters.items() if key != 'org'}
+    if orgs is not None:
+        provider_filters['org'] = list(orgs)
+    df = filter_data(data, provider_filters)
+    if orgs is None:
+        in_icb = np.zeros(len(df), dtype=bool)
+        for column in ['hlhg', 'icb_code', 'ICB23NM']:
+            in_icb |= (geography_column(df, column) == icb).to_numpy()
+        df = df[in_icb]
+    series = proportion_breaches_by_series(df, window_size=window_size,
+                                           by=['org_code'])
+    if series.empty:
+        raise ValueError(f'No data for the trusts with filters {filters}')
+
+    # National series for the same standard and months, computed once
+    national_filters = {key: value for key, value in filters.items()
+                        if key in ('standard', 'start_month', 'end_month')}
+    national = proportion_breaches_by_series(
+        filter_data(get_national_data(national_data_link), national_filters),
+        window_size=window_size, by=['org_code'])
+    national = national.loc[series.index.min():series.index.max()]
+
+    column = 'proportion_breaches' if window_size == 1 else 'moving_average'
+    if orgs is None:
+        panel_orgs = sorted(series['org_code'].unique())
+    else:
+        present = set(series['org_code'])
+        panel_orgs = [org for org in dict.fromkeys(org[:3].upper() for org in orgs)
+                      if org in present]
+
+    nrows = -(-len(panel_orgs) // ncols)
+    fig, axes = plt.subplots(nrows, ncols, sharex=True, sharey=True,
+                             squeeze=False,
+                             figsize=(panel_size[0] * ncols, panel_size[1] * nrows))
+    axes = axes.ravel()
+
+    by_org = dict(list(series.groupby('org_code', observed=True)[column]))
+    for ax, org in zip(axes, panel_orgs):
+        ax.plot(national.index, national[column], color='grey',
+                linestyle='--', linewidth=1, label='National')
+        ax.plot(by_org[org].index, by_org[org], label=org)
+        ax.set_title(org, fontsize=9)
+        ax.grid()
+    for ax in axes[len(panel_orgs):]:
+        ax.set_visible(False)
+
+    threshold = STANDARD_THRESHOLDS.get(standard)
+    if threshold is not None:
+        for ax in axes[:len(panel_orgs)]:
+            ax.axhline(threshold, color='red', linewidth=0.5)
+
+    fig.supxlabel('Month')
+    fig.supylabel('Proportion of breaches')
+    fig.suptitle(f'Proportion of breaches for {standard} compared to national')
+    axes[0].legend(['National', 'Trust'], loc='upper left', fontsize='7')
+    locator = mdates.AutoDateLocator(maxticks=5)
+    axes[0].xaxis.set_major_locator(locator)
+    axes[0].xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+    return fig, axes[:len(panel_orgs)]
+
+
+@stage('breaches_animated_plot')
+def breaches_animated_plot(data, filters={}, window_size=5):
+    """
+    Create an animated plot of the proportion of breaches with a moving
+    average, one pair of lines per organisation.
 
-    # Create the interactive graph
-    fig = go.Figure()
+    Every trace holds its whole series once. Each animation frame only
+    moves the end of the x axis forward a month, so the figure grows
+    linearly with the number of months and long histories such as the
+    national series stay small.
 
-    # Add a scatter plot for the proportion of breaches
-    fig.add_trace(go.Scatter(x=data['PERIOD'],
-                             y=data['PROPORTION_BREACHES'],
-                             mode='lines+markers',
-                             name='Proportion of Breaches'))
+    Parameters
+    ----------
+    - data : DataFrame or ProviderIndex
+        Provider data, national data (get_national_data()) or both
+        concatenated. See filter_data().
+    - filters : dict, optional
+        Filters to apply, see filter_data(). Breaches and totals are summed
+        for each organisation and month, so a single standard should be
+        selected. Use 'org' to choose the organisations plotted.
+        The default is {} (no filtering).
+    - window_size : int, optional
+        Number of months over which the moving average is taken.
+        The default is 5.
 
-    # Add a line plot for the moving average
-    fig.add_trace(go.Scatter(x=data['PERIOD'],
-                             y=data['MOVING_AVERAGE'],
-                             mode='lines',
-                             name=f'Moving Average (Window={window_size})'))
+    Returns
+    -------
+    - fig : plotly.graph_objects.Figure
+        The plot is also displayed interactively.
 
-    # Customize the layout
+    Examples
+    --------
+    >>> breaches_animated_plot(data, {'standard': 'FDS',
+    ...                               'org': ['RWP', 'RXQ']}, window_size=3)
+    """
+    # Apply filters to the data
+    df = filter_data(data, filters)
+    series = proportion_breaches_by_series(df, window_size=window_size,
+                                           by=['org_code'])
+    if series.empty:
+        raise ValueError(f'No data for filters {filters}')
+
+    # Create the interactive graph, one colour per organisation
+    fig = go.Figure()
+    colours = plotly_colors.qualitative.Plotly
+    for i, (org, org_series) in enumerate(series.groupby('org_code', observed=True)):
+        colour = colours[i % len(colours)]
+        months = org_series.index.strftime('%Y-%m-%d')
+        fig.add_trace(go.Scatter(x=months,
+                                 y=org_series['proportion_breaches'],
+                                 mode='markers',
+                                 marker=dict(color=colour, size=5),
+                                 legendgroup=org,
+                                 name=f'{org} proportion of breaches'))
+        fig.add_trace(go.Scatter(x=months,
+                                 y=org_series['moving_average'],
+                                 mode='lines',
+                                 line=dict(color=colour),
+                                 legendgroup=org,
+                                 name=f'{org} moving average (window={window_size})'))
+
+    # Frames only change the x axis range, revealing one more month each
+    months = series.index.unique().sort_values()
+    start = (months[0] - pd.Timedelta(days=15)).strftime('%Y-%m-%d')
+    frame_ends = (months + pd.Timedelta(days=15)).strftime('%Y-%m-%d')
+    labels = months.strftime('%b %Y')
+    fig.frames = [go.Frame(name=label, layout=dict(xaxis=dict(range=[start, end])))
+                  for label, end in zip(labels, frame_ends)]
+
+    y_max = np.nanmax(series['proportion_breaches'].to_numpy(dtype=float))
+    frame_args = dict(mode='immediate', frame=dict(duration=100, redraw=False),
+                      transition=dict(duration=0))
     fig.update_layout(
         title='Proportion of Breaches Over Time',
-        xaxis_title='Period',
+        xaxis_title='Month',
         yaxis_title='Proportion of Breaches',
         hovermode='x',
-        xaxis=dict(tickmode='array',
-                   # Convert datetime to timestamp in seconds
-                   tickvals=data['PERIOD'].astype(int) / 10**9,
-                   # Display months and years as tick labels
-                   ticktext=data['PERIOD'].dt.strftime('%b %Y'),
-                   ),
-        updatemenus=[dict(
-            type='buttons',
-            showactive=False,
-            buttons=[dict(
-                label='Play',
-                method='animate',
-                args=[None,
-                      dict(frame=dict(duration=500, redraw=True),
-                           fromcurrent=True)])
-                     ])
-                     ])
-
-    # Create animation frames
-    frames = [go.Frame(data=[go.Scatter(x=data['PERIOD'].iloc[:i + 1],
-                                        y=data['MOVING_AVERAGE'].iloc[:i + 1],
-                                        mode='lines',
-                                        marker=dict(color='red'),
-                                        name=f'Moving Average (Window={window_size})')]) for i in range(len(data))]
-
-    # Add frames to the figure
-    fig.frames = frames
+        xaxis=dict(range=[start, frame_ends[-1]], type='date'),
+        yaxis=dict(range=[0, 1.05 * y_max if y_max > 0 else 1]),
+        sliders=[dict(active=len(labels) - 1, currentvalue=dict(prefix='Month: '),
+                      steps=[dict(label=label, method='animate',
+                                  args=[[label], frame_args])
+                             for label in labels])],
+        updatemenus=[dict(type='buttons', showactive=False,
+                          buttons=[dict(label='Play', method='animate',
+                                        args=[None, frame_args])])])
 
     # Show the interactive plot
     fig.show()
+    return fig
 
 def create_cmap(threshold=0.25):
     """
@@ -255,11 +423,11 @@ def create_cmap(threshold=0.25):
     num_colors_above_inflection = 256 - num_colors_below_inflection
 
     # Create the colormap using LinearSegmentedColormap
-    cmap_below_inflection = LinearSegmentedColormap.from_list(
+    cmap_below_inflection = mcolors.LinearSegmentedColormap.from_list(
         'below_inflection', colors_below_inflection, N=num_colors_below_inflection
      )
     
-    cmap_above_inflection = LinearSegmentedColormap.from_list(
+    cmap_above_inflection = mcolors.LinearSegmentedColormap.from_list(
         'above_inflection', colors_above_inflection, N=num_colors_above_inflection
     )
 
@@ -270,16 +438,24 @@ def create_cmap(threshold=0.25):
     )
 
     # Create a custom colormap with an inflection point at the specified threshold
-    custom_cmap = LinearSegmentedColormap.from_list(
+    custom_cmap = mcolors.LinearSegmentedColormap.from_list(
         'custom_colormap', cmap_custom, N=256
     )
 
     return custom_cmap
 
-def read_shapefile():
+@stage('read_shapefile')
+def read_shapefile(tolerance=0):
     """
-    Read and return a GeoDataFrame from an ONS shapefile for
-        Integrated Care Boards (ICBs).
+    Read and return a GeoDataFrame of the Integrated Care Boards (ICBs),
+        dissolved from the ONS Sub-ICB location shapefile.
+    The shapefile is parsed once per process, see canseer.geometry.
+
+    Parameters
+    ----------
+    - tolerance : int, optional
+        Simplify the boundaries to this many metres, one of
+        canseer.geometry.SIMPLIFY_TOLERANCES. The default is 0 (full detail).
 
     Returns
     -------
@@ -287,12 +463,10 @@ def read_shapefile():
         A GeoDataFrame containing geographical information for ICBs.
 
     """
-    path_to_shapefile = ('canseer/data/ons_shapefile/'
-                         + 'Integrated_Care_Boards_'
-                         + 'April_2023_EN_BFC_1659257819249669363/')
-    gdf = gpd.read_file(path_to_shapefile)
+    gdf = icb_geometry(tolerance)
     return gdf
 
+@stage('create_lookup_dict_icb')
 def create_lookup_dict_icb():
     """
     Create lookup dictionaries for ICB codes and NHS Trust organization codes.
@@ -332,6 +506,24 @@ def create_lookup_dict_icb():
     return icb_code_to_names, org_to_hlhg
 
 
+def _map_labels(filtered_df):
+    """Labels of a filtered dataframe used by format_map_label()."""
+    return {'cancer_type': filtered_df.cancer_type.unique(),
+            'period': filtered_df.index.unique(),
+            'standard': filtered_df.standard.unique()}
+
+
+def _area_breaches(filtered_df, area_names):
+    """
+    Proportion of breaches for each area, rounded to 2 decimal places.
+    area_names gives the area (e.g. ICB23NM) of each row of filtered_df.
+    """
+    area_sums = filtered_df[['breaches', 'total']].groupby(area_names, observed=True).sum()
+    area_breaches = round(area_sums['breaches'] / area_sums['total'], 2).astype(float)
+    return area_breaches.rename('proportion_breaches')
+
+
+@stage('select_to_plot')
 def select_to_plot(data, gdf=None, filters=None, start_month='2022-04-01',
                    end_month='2023-03-01', standard='FDS',
                    stage_or_route=None, treatment=None,
@@ -341,8 +533,9 @@ def select_to_plot(data, gdf=None, filters=None, start_month='2022-04-01',
 
     Parameters
     ----------
-    - data : DataFrame
-        The input DataFrame containing the data to be filtered and plotted.
+    - data : DataFrame or ProviderIndex
+        The input DataFrame containing the data to be filtered and plotted,
+        or a ProviderIndex built over it (see filter_data()).
     - gdf : GeoDataFrame, optional
         The GeoDataFrame representing the geographical data
         for mapping. Default is None.
@@ -409,24 +602,8 @@ def select_to_plot(data, gdf=None, filters=None, start_month='2022-04-01',
 
     filtered_df = filter_data(data, filter_dict)
 
-    icb_code_to_names, org_to_hlhg = create_lookup_dict_icb()
-
-    # Explicitly create a copy to avoid chained indexing
-    filtered_df = filtered_df.copy()
-
-    # Use .loc to modify the original DataFrame
-    filtered_df.loc[:, 'hlhg'] = filtered_df.loc[:, 'org_code'].map(org_to_hlhg)
-    filtered_df.loc[:, 'ICB23NM'] = filtered_df.loc[:, 'hlhg'].map(icb_code_to_names)
-
-    labels_for_plotting = {'cancer_type': filtered_df.cancer_type.unique(),
-                           'period': filtered_df.index.unique(),
-                           'standard': filtered_df.standard.unique()}
-
-    icb_breaches = round(filtered_df.groupby('ICB23NM').breaches.sum()
-                         / filtered_df.groupby('ICB23NM').total.sum(), 2
-                        ).astype(float)
-
-    icb_breaches.rename('proportion_breaches', inplace=True)
+    labels_for_plotting = _map_labels(filtered_df)
+    icb_breaches = _area_breaches(filtered_df, geography_column(filtered_df, 'ICB23NM'))
 
     if gdf is None:
         gdf = read_shapefile()
@@ -436,10 +613,11 @@ def select_to_plot(data, gdf=None, filters=None, start_month='2022-04-01',
     if not return_filtered:
         return merged_gdf, labels_for_plotting
     elif return_filtered:
+        filtered_df = attach_geography(filtered_df, ['hlhg', 'ICB23NM'])
         return merged_gdf, labels_for_plotting, filtered_df
     
     
-def format_map_label(label_dict):
+def format_map_label(label_dict, map_name='ICB'):
     """
     Format a label for an Integrated Care Board (ICB) map based
         on the provided information.
@@ -449,6 +627,8 @@ def format_map_label(label_dict):
     label_dict : dict
         Dictionary containing information for the label.
         Output of the 'select_to_plot()' function
+    map_name : str, optional
+        Areas shown on the map, e.g. 'NHS region'. Default is 'ICB'.
 
     Returns
     -------
@@ -485,28 +665,30 @@ def format_map_label(label_dict):
 
     standard_str = label_dict['standard'][0]
 
-    label = (f"ICB map for {standard_str} standard.\n"
+    label = (f"{map_name} map for {standard_str} standard.\n"
              + f"Cancer types: {cancer_type}\n"
              + f"Period from {start_date} to {end_date}")
 
     return label
 
 
+@stage('plot_icb_map')
 def plot_icb_map(data, filters={'standard':'FDS'},
                  figsize=(7, 7), dpi=300,
                  edgecolor='black', lw=0.2):
     """
     Plot an Integrated Care Board (ICB) map based on specified filters.
     Colourmap is reflects which ICBs meet the NHS target for specific standard.
-
+    Same as plot_map() with level='icb', boundaries are simplified to the
+    resolution of the figure.
 
     Parameters
     ----------
-    - data : DataFrame
+    - data : DataFrame or ProviderIndex
         DataFrame containing the necessary data for mapping.
     - filters : dict, optional
-        Dictionary specifying filters for data selection.
-        Defaults to {'standard': 'FDS'}. See filter_data()
+        Dictionary specifying filters for data selection, with a single
+        'standard'. Defaults to {'standard': 'FDS'}. See filter_data()
     - figsize : tuple, optional
         Tuple specifying the figure size. Defaults to (7, 7).
     - dpi : int, optional
@@ -527,20 +709,14 @@ def plot_icb_map(data, filters={'standard':'FDS'},
     --------
     >>> plot_icb_map(data, filters={'standard': 'FDS'})
     """
-    if filters is None:
-        print('Data filtering has been suppressed: '
-              '"filters" is an empty dict. '
-              'Continuing with default select_data() params')
-        geodf, all_labels = select_data(data, filters=None)
-    else:
-        geodf, all_labels = select_to_plot(data, filters=filters)
-        if filters['standard'] == 'FDS':
-            threshold = 0.25
-        elif filters['standard'] == 'DTT':
-            threshold = 0.04
-        elif filters['standard'] == 'RTT':
-            threshold = 0.15
+    return plot_map(data, filters, level='icb', figsize=figsize, dpi=dpi,
+                    edgecolor=edgecolor, lw=lw)
+
 
+@stage('render_map')
+def _plot_breaches_map(geodf, all_labels, standard, threshold,
+                       figsize, dpi, edgecolor, lw, map_name='ICB'):
+    """Draws proportion_breaches of geodf, for plot_map()."""
     fig, ax = plt.subplots(figsize=figsize, dpi=dpi)
 
     # Plot the GeoDataFrame with specified colormap subplot 'ax'
@@ -548,21 +724,21 @@ def plot_icb_map(data, filters={'standard':'FDS'},
                cmap=create_cmap(threshold=threshold),
                legend=False, edgecolor=edgecolor, linewidth=lw, ax=ax)
 
-    plt.title(label=format_map_label(all_labels), fontdict={'fontsize': 7})
+    plt.title(label=format_map_label(all_labels, map_name), fontdict={'fontsize': 7})
 
     # Create a colorbar next to the subplot
-    divider = make_axes_locatable(ax)
+    divider = axes_grid1.make_axes_locatable(ax)
     cax = divider.append_axes("right", size="5%", pad=0.1)
 
     # Adjust the normalization based on the data range
-    sm = ScalarMappable(
+    sm = mcm.ScalarMappable(
         cmap=create_cmap(threshold=threshold),
-        norm=Normalize(vmin=0, vmax=1)
+        norm=mcolors.Normalize(vmin=0, vmax=1)
     )
     sm.set_array([])
     plt.colorbar(sm, cax=cax,
                  label=(("Proportion of Breaches\nNHS target threshold"
-                         + f"for {filters['standard']} "
+                         + f"for {standard} "
                          + f"(<{int(100*threshold)}% breaches)")
                        )
                 )
@@ -577,3 +753,337 @@ def plot_icb_map(data, filters={'standard':'FDS'},
     plt.show()
 
     return fig, ax
+
+
+@stage('plot_map')
+def plot_map(data, filters={'standard': 'FDS'}, level='icb',
+             figsize=(7, 7), dpi=300, edgecolor='black', lw=0.2):
+    """
+    Plot a map of the proportion of breaches at Sub-ICB location (SICBL),
+    ICB or NHS region level.
+
+    All levels are drawn from the bundled SICBL boundaries, with ICB and
+    region boundaries dissolved from them once and cached
+    (see canseer.geometry.map_geometry()). Boundaries are simplified to the
+    resolution of the figure.
+
+    Parameters
+    ----------
+    - data : DataFrame or ProviderIndex
+        Provider data, see plot_icb_map().
+    - filters : dict, optional
+        Dictionary specifying filters for data selection, with a single
+        'standard'. Defaults to {'standard': 'FDS'}. See filter_data()
+    - level : str, optional
+        'sicbl', 'icb' or 'region'. Defaults to 'icb'.
+    - figsize : tuple, optional
+        Tuple specifying the figure size. Defaults to (7, 7).
+    - dpi : int, optional
+        Dots per inch for the figure resolution. Defaults to 300.
+    - edgecolor : str, optional
+        Colour of the map boundaries. Defaults to 'black'.
+    - lw : float, optional
+        Line width of the map boundaries. Defaults to 0.2.
+
+    Returns
+    -------
+    - fig : matplotlib.figure.Figure
+        The created matplotlib Figure.
+    - ax : matplotlib.axes._subplots.AxesSubplot
+        The created matplotlib AxesSubplot.
+
+    Notes
+    -----
+    Trusts are placed in an ICB through their Higher Level Health Geography,
+    so provider data is aggregated to ICBs or regions. On a SICBL map each
+    Sub-ICB location is coloured with the value of its ICB, with the finer
+    SICBL boundaries drawn.
+
+    Examples
+    --------
+    >>> plot_map(data, filters={'standard': 'RTT'}, level='region')
+    """
+    if level not in LEVEL_DATA_COLUMNS:
+        raise ValueError(f'level should be one of {list(LEVEL_DATA_COLUMNS)}')
+    key = LEVEL_DATA_COLUMNS[level]
+
+    filtered_df = filter_data(data, filters)
+    area_breaches = _area_breaches(filtered_df, geography_column(filtered_df, key))
+
+    gdf = map_geometry(level, tolerance_for_figure(figsize, dpi))
+    geodf = pd.merge(gdf, area_breaches, left_on=key, right_index=True)
+
+    standard = filters['standard']
+    return _plot_breaches_map(geodf, _map_labels(filtered_df), standard,
+                              STANDARD_THRESHOLDS[standard], figsize, dpi,
+                              edgecolor, lw, map_name=LEVEL_NAMES[level])
+
+
+def _plotly_colorscale(cmap, n_colors=64):
+    """Samples a matplotlib colormap into a Plotly colorscale."""
+    positions = np.linspace(0, 1, n_colors)
+    return [[position, 'rgba({:.0f},{:.0f},{:.0f},{:.3f})'.format(
+                *(255 * np.asarray(rgba[:3])), rgba[3])]
+            for position, rgba in zip(positions, cmap(positions))]
+
+
+@stage('plot_icb_map_interactive')
+def plot_icb_map_interactive(data, filters={'standard': 'FDS'}, level='icb',
+                             tolerance=250):
+    """
+    Interactive map of the proportion of breaches with a slider over months.
+
+    The boundaries are sent to the browser once as GeoJSON and drawn with
+    WebGL. The proportion of breaches of every area and month is computed
+    in one aggregation, and each month becomes an animation frame holding
+    only the colour values, so moving the slider does not run any Python.
+
+    Parameters
+    ----------
+    - data : DataFrame or ProviderIndex
+        Provider data, see plot_icb_map().
+    - filters : dict, optional
+        Dictionary specifying filters for data selection, with a single
+        'standard'. Every month left after filtering gets a frame.
+        Defaults to {'standard': 'FDS'}. See filter_data()
+    - level : str, optional
+        'sicbl', 'icb' or 'region', see plot_map(). Defaults to 'icb'.
+    - tolerance : int, optional
+        Simplification of the boundaries in metres, see
+        canseer.geometry.map_geojson(). Defaults to 250.
+
+    Returns
+    -------
+    - fig : plotly.graph_objects.Figure
+        Show it with fig.show() or save it with fig.write_html().
+
+    Examples
+    --------
+    >>> fig = plot_icb_map_interactive(data, {'standard': 'FDS',
+    ...                                       'start_month': '2022-04-01',
+    ...                                       'end_month': '2023-03-01'})
+    >>> fig.write_html('fds_by_month.html')
+    """
+    if level not in LEVEL_DATA_COLUMNS:
+        raise ValueError(f'level should be one of {list(LEVEL_DATA_COLUMNS)}')
+    key = LEVEL_DATA_COLUMNS[level]
+
+    filtered_df = filter_data(data, filters)
+    if filtered_df.empty:
+        raise ValueError(f'No data for filters {filters}')
+
+    # months x areas table of the proportion of breaches
+    sums = (filtered_df[['breaches', 'total']]
+            .groupby([filtered_df.index, geography_column(filtered_df, key)],
+                     observed=True)
+            .sum())
+    proportions = (sums['breaches'] / sums['total']).round(2).unstack()
+
+    # One column per map feature, SICBLs take the value of their ICB
+    gdf = map_geometry(level, tolerance)
+    locations = gdf[MAP_LEVELS[level]].tolist()
+    z = proportions.reindex(columns=gdf[key]).to_numpy(dtype=float)
+    months = proportions.index.strftime('%b %Y').tolist()
+
+    standard = filters['standard']
+    threshold = STANDARD_THRESHOLDS[standard]
+    labels = _map_labels(filtered_df)
+    labels['period'] = labels['period'].sort_values()
+
+    # Choroplethmap (MapLibre) replaced Choroplethmapbox in plotly 5.24
+    if hasattr(go, 'Choroplethmap'):
+        choropleth, map_layout = go.Choroplethmap, 'map'
+    else:
+        choropleth, map_layout = go.Choroplethmapbox, 'mapbox'
+
+    fig = go.Figure(
+        data=[choropleth(geojson=map_geojson(level, tolerance),
+                         locations=locations, z=z[0],
+                         zmin=0, zmax=1,
+                         colorscale=_plotly_colorscale(create_cmap(threshold)),
+                         marker_line_width=0.5,
+                         hovertemplate='%{location}<br>%{z:.2f}<extra></extra>',
+                         colorbar=dict(title=("Proportion of Breaches<br>"
+                                              + f"NHS target threshold for {standard}<br>"
+                                              + f"(<{int(100*threshold)}% breaches)")))],
+        frames=[go.Frame(name=month, data=[choropleth(z=row)], traces=[0])
+                for month, row in zip(months, z)])
+
+    frame_args = dict(mode='immediate', frame=dict(duration=0, redraw=True),
+                      transition=dict(duration=0))
+    fig.update_layout(
+        title=dict(text=format_map_label(labels, LEVEL_NAMES[level]).replace('\n', '<br>'),
+                   font=dict(size=12)),
+        margin=dict(l=0, r=0, t=80, b=0),
+        sliders=[dict(active=0, currentvalue=dict(prefix='Month: '),
+                      steps=[dict(label=month, method='animate',
+                                  args=[[month], frame_args])
+                             for month in months])],
+        updatemenus=[dict(type='buttons', showactive=False, x=0, y=0,
+                          xanchor='right', yanchor='top',
+                          buttons=[dict(label='Play', method='animate',
+                                        args=[None, dict(frame_args, fromcurrent=True,
+                                                         frame=dict(duration=500,
+                                                                    redraw=True))])])],
+        **{map_layout: dict(style='white-bg', zoom=5,
+                            center=dict(lat=52.8, lon=-1.6))})
+    return fig
+
+
+def _geometry_paths(gdf):
+    """
+    Returns one matplotlib Path per row of gdf, with all polygon parts and
+    holes of the row in a single compound path.
+    """
+    paths = []
+    for geom in gdf.geometry:
+        polygons = getattr(geom, 'geoms', [geom])
+        rings = [mpath.Path(np.asarray(ring.coords)[:, :2])
+                 for polygon in polygons
+                 for ring in [polygon.exterior, *polygon.interiors]]
+        paths.append(mpath.Path.make_compound_path(*rings))
+    return paths
+
+
+@stage('render_icb_maps')
+def _render_icb_maps(data, jobs, figsize, dpi, edgecolor, lw, level='icb'):
+    """
+    Renders (filters, path) jobs with one geometry load and one figure.
+    Returns the paths written, None for maps with no data.
+    """
+    gdf = map_geometry(level, tolerance_for_figure(figsize, dpi))
+    key, map_name = LEVEL_DATA_COLUMNS[level], LEVEL_NAMES[level]
+
+    # Figure is not managed by pyplot, so no GUI backend is used
+    fig = mfigure.Figure(figsize=figsize, dpi=dpi)
+    ax = fig.add_subplot()
+    patches = [mpatches.PathPatch(path) for path in _geometry_paths(gdf)]
+    boundaries = mcollections.PatchCollection(patches, linewidth=lw)
+    ax.add_collection(boundaries)
+    ax.autoscale_view()
+    ax.set_aspect('equal')
+    ax.tick_params(axis='both', which='both', bottom=False, left=False,
+                   labelbottom=False, labelleft=False)
+
+    divider = axes_grid1.make_axes_locatable(ax)
+    cax = divider.append_axes("right", size="5%", pad=0.1)
+    norm = mcolors.Normalize(vmin=0, vmax=1)
+    sm = mcm.ScalarMappable(cmap=create_cmap(), norm=norm)
+    sm.set_array([])
+    colorbar = fig.colorbar(sm, cax=cax)
+
+    written = []
+    for filters, path in jobs:
+        filtered_df = filter_data(data, filters)
+        if filtered_df.empty:
+            print(f'No data for filters {filters}, map not written')
+            written.append(None)
+            continue
+
+        area_breaches = _area_breaches(filtered_df,
+                                       geography_column(filtered_df, key))
+        values = gdf[key].map(area_breaches).to_numpy(dtype=float)
+
+        standard = filters['standard']
+        threshold = STANDARD_THRESHOLDS[standard]
+        cmap = create_cmap(threshold=threshold)
+
+        # Areas without data are left out of the map
+        facecolors = cmap(norm(values))
+        edgecolors = np.tile(mcolors.to_rgba(edgecolor), (len(values), 1))
+        facecolors[np.isnan(values)] = 0
+        edgecolors[np.isnan(values)] = 0
+        boundaries.set_facecolor(facecolors)
+        boundaries.set_edgecolor(edgecolors)
+
+        sm.set_cmap(cmap)
+        colorbar.update_normal(sm)
+        colorbar.set_label("Proportion of Breaches\nNHS target threshold"
+                           + f"for {standard} "
+                           + f"(<{int(100*threshold)}% breaches)")
+        ax.set_title(format_map_label(_map_labels(filtered_df), map_name), fontsize=7)
+
+        fig.savefig(path, dpi=dpi)
+        written.append(path)
+    return written
+
+
+@stage('plot_icb_maps')
+def plot_icb_maps(data, filters_list, out_dir='.', file_names=None,
+                  figsize=(7, 7), dpi=300, edgecolor='black', lw=0.2,
+                  processes=None, level='icb'):
+    """
+    Write many ICB maps to image files, e.g. one per standard, cancer type
+    and month.
+
+    Unlike calling plot_icb_map() repeatedly, the boundaries are loaded
+    once and drawn once on a single figure. Each map only updates the fill
+    colours, colourbar and title before being saved. No window is opened,
+    so this works on servers without a display. Boundaries are simplified
+    to the resolution of the figure.
+
+    Parameters
+    ----------
+    - data : DataFrame or ProviderIndex
+        Provider data, see plot_icb_map().
+    - filters_list : list of dict
+        One filters dictionary per map, see filter_data().
+        Each must have a single 'standard', 'FDS', 'DTT' or 'RTT'.
+    - out_dir : str, optional
+        Directory the images are written to. Defaults to '.'.
+    - file_names : list of str, optional
+        File name for each map, the extension sets the image format.
+        Defaults to 'icb_map_000.png', 'icb_map_001.png', ...
+    - figsize : tuple, optional
+        Figure size. Defaults to (7, 7).
+    - dpi : int, optional
+        Resolution of the images. Defaults to 300.
+    - edgecolor : str, optional
+        Colour of the map boundaries. Defaults to 'black'.
+    - lw : float, optional
+        Line width of the map boundaries. Defaults to 0.2.
+    - processes : int, optional
+        If given, the maps are split between this many worker processes,
+        each loading the geometry once. Defaults to None (no workers).
+    - level : str, optional
+        'sicbl', 'icb' or 'region' to draw the maps at that level, see
+        plot_map(). Defaults to 'icb'.
+
+    Returns
+    -------
+    - paths : list of str
+        Path of each image written, in the order of filters_list.
+        None where the filters matched no data.
+
+    Examples
+    --------
+    >>> filters_list = [{'standard': s, 'start_month': m, 'end_month': m}
+    ...                 for s in ['FDS', 'DTT', 'RTT']
+    ...                 for m in ['2022-04-01', '2022-05-01']]
+    >>> plot_icb_maps(data, filters_list, out_dir='maps', processes=4)
+    """
+    if file_names is None:
+        file_names = [f'icb_map_{i:03d}.png' for i in range(len(filters_list))]
+    if len(file_names) != len(filters_list):
+        raise ValueError('file_names and filters_list have different lengths')
+
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [(filters, os.path.join(out_dir, name))
+            for filters, name in zip(filters_list, file_names)]
+    if level not in LEVEL_DATA_COLUMNS:
+        raise ValueError(f'level should be one of {list(LEVEL_DATA_COLUMNS)}')
+    render_args = (figsize, dpi, edgecolor, lw, level)
+
+    if not processes or processes < 2 or len(jobs) < 2:
+        return _render_icb_maps(data, jobs, *render_args)
+
+    # Share the maps out between the workers
+    n_workers = min(processes, len(jobs))
+    blocks = [jobs[i::n_workers] for i in range(n_workers)]
+    with concurrent.futures.ProcessPoolExecutor(n_workers) as pool:
+        results = pool.map(_render_icb_maps, [data] * n_workers, blocks,
+                           *[[arg] * n_workers for arg in render_args])
+        written = {}
+        for block, paths in zip(blocks, results):
+            written.update(zip([path for _, path in block], paths))
+    return [written[path] for _, path in jobs]
@@ -0,0 +1,183 @@
+import json
+import weakref
+import numpy as np
+import pandas as pd
+
+# Columns described by a catalog, as filtered by filter_data()
+CATALOG_COLUMNS = ['standard', 'org_code', 'cancer_type',
+                   'treatment_modality', 'stage_or_route']
+
+# Key of the catalog in the schema metadata of a snapshot
+CATALOG_METADATA_KEY = b'canseer.catalog'
+
+# id(df) -> (weak reference to df, catalog), see register_catalog()
+_catalogs = {}
+
+
+class DataCatalog:
+    """
+    Statistics of a provider or national dataframe: its number of rows, the
+    rows of each month and the rows of each value of the categorical
+    columns (CATALOG_COLUMNS).
+
+    Built once when data is loaded (see build_catalog()) and saved with
+    snapshots, a catalog answers "is this value in the data?" with a set
+    lookup and "how many rows would this filter keep?" without scanning
+    the columns. The select_* functions and filter_data() validate values
+    with it, and compile_filters() evaluates the most selective filter
+    first.
+
+    A catalog describes the frame it was built from, as it was then.
+    Frames derived from it, e.g. by filtering, have no catalog, and a
+    frame changed in place should be given a new one with build_catalog().
+
+    Parameters
+    ----------
+    - n_rows : int
+        Rows of the frame.
+    - month_rows : dict
+        Month (Timestamp) -> rows, for frames indexed by month.
+    - value_rows : dict
+        Column -> {value: rows}, for the values present in the column.
+    """
+
+    def __init__(self, n_rows, month_rows, value_rows):
+        self.n_rows = int(n_rows)
+        self.month_rows = pd.Series(month_rows, dtype=np.int64).sort_index()
+        self.value_rows = {column: dict(rows) for column, rows in value_rows.items()}
+        self._values = {column: frozenset(rows) for column, rows in self.value_rows.items()}
+
+    @classmethod
+    def from_frame(cls, df):
+        """Counts the rows of each month and column value of df."""
+        value_rows = {}
+        for column in CATALOG_COLUMNS:
+            if column not in df.columns:
+                continue
+            values = df[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                codes = values.cat.codes.to_numpy()
+                counts = np.bincount(codes[codes >= 0],
+                                     minlength=len(values.cat.categories))
+                present = np.flatnonzero(counts)
+                value_rows[column] = dict(zip(values.cat.categories[present],
+                                              counts[present].tolist()))
+            else:
+                value_rows[column] = values.value_counts().to_dict()
+
+        month_rows = {}
+        if isinstance(df.index, pd.DatetimeIndex):
+            codes, months = pd.factorize(df.index)
+            counts = np.bincount(codes[codes >= 0], minlength=len(months))
+            month_rows = dict(zip(months, counts.tolist()))
+        return cls(len(df), month_rows, value_rows)
+
+    def to_dict(self):
+        """Returns the catalog as JSON-serialisable lists and dicts."""
+        return {'n_rows': self.n_rows,
+                'month_rows': {month.strftime('%Y-%m-%d'): int(rows)
+                               for month, rows in self.month_rows.items()},
+                'value_rows': {column: {str(value): int(rows) for value, rows in counts.items()}
+                               for column, counts in self.value_rows.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuilds a catalog from to_dict()."""
+        return cls(data['n_rows'],
+                   {pd.Timestamp(month): rows for month, rows in data['month_rows'].items()},
+                   data['value_rows'])
+
+    def __contains__(self, column):
+        return column in self._values
+
+    def __repr__(self):
+        months = ''
+        if len(self.month_rows):
+            first, last = self.month_range
+            months = f', months {first:%Y-%m} to {last:%Y-%m}'
+        columns = ', '.join(f'{column}: {len(values)}' for column, values in self._values.items())
+        return f'<DataCatalog {self.n_rows} rows{months}; values {columns}>'
+
+    @property
+    def month_range(self):
+        """First and last month, or (None, None) if not indexed by month."""
+        if not len(self.month_rows):
+            return None, None
+        return self.month_rows.index[0], self.month_rows.index[-1]
+
+    def values(self, column):
+        """Returns the set of values present in column."""
+        return self._values[column]
+
+    def rows(self, column, values):
+        """Returns the number of rows with one of values in column."""
+        counts = self.value_rows[column]
+        return sum(counts.get(value, 0) for value in values)
+
+    def month_rows_between(self, start=None, end=None):
+        """Returns the number of rows of the months from start to end."""
+        months = self.month_rows.index
+        keep = np.ones(len(months), dtype=bool)
+        if start is not None:
+            keep &= months >= start
+        if end is not None:
+            keep &= months <= end
+        return int(self.month_rows.to_numpy()[keep].sum())
+
+    def restrict(self, columns):
+        """Returns the catalog of the same rows with only some columns."""
+        return DataCatalog(self.n_rows, self.month_rows,
+                           {column: rows for column, rows in self.value_rows.items()
+                            if column in columns})
+
+
+def register_catalog(df, catalog):
+    """Attaches catalog to the frame df, see get_catalog(). Returns df."""
+    key = id(df)
+    # The entry is removed when df is garbage collected
+    reference = weakref.ref(df, lambda _, key=key: _catalogs.pop(key, None))
+    _catalogs[key] = (reference, catalog)
+    return df
+
+
+def build_catalog(df):
+    """
+    Computes the DataCatalog of df and attaches it, so validation and
+    filtering of df use it.
+
+    Parameters
+    ----------
+    - df : Dataframe
+        Provider or national dataframe.
+
+    Returns
+    -------
+    - catalog : DataCatalog
+    """
+    catalog = DataCatalog.from_frame(df)
+    register_catalog(df, catalog)
+    return catalog
+
+
+def get_catalog(df):
+    """
+    Returns the DataCatalog attached to df, or None if df has none or has
+    changed number of rows since it was built.
+    """
+    entry = _catalogs.get(id(df))
+    if entry is None or entry[0]() is not df:
+        return None
+    catalog = entry[1]
+    return catalog if catalog.n_rows == len(df) else None
+
+
+def catalog_metadata(catalog):
+    """Schema metadata holding catalog, for a snapshot file."""
+    return {CATALOG_METADATA_KEY: json.dumps(catalog.to_dict()).encode()}
+
+
+def catalog_from_metadata(metadata):
+    """Returns the catalog in snapshot schema metadata, or None."""
+    if not metadata or CATALOG_METADATA_KEY not in metadata:
+        return None
+    return DataCatalog.from_dict(json.loads(metadata[CATALOG_METADATA_KEY]))
@@ -0,0 +1,205 @@
+import numpy as np
+import pandas as pd
+from canseer.data_wrangling import FILTER_COLUMNS, _resolve_filter
+
+# Dimensions a ProviderCube can group by
+CUBE_DIMENSIONS = ['month', 'org_code', 'standard', 'cancer_type',
+                   'treatment_modality', 'stage_or_route']
+
+# Groupings precomputed by default. Together they answer national, trust
+# and cancer type roll-ups for any standard and month range.
+DEFAULT_GROUPINGS = [
+    ('month', 'standard'),
+    ('month', 'org_code', 'standard'),
+    ('month', 'standard', 'cancer_type'),
+    ('month', 'org_code', 'standard', 'cancer_type'),
+    ('month', 'standard', 'cancer_type', 'treatment_modality', 'stage_or_route'),
+    ('month', 'org_code', 'standard', 'treatment_modality', 'stage_or_route'),
+]
+
+
+class ProviderCube:
+    """
+    Pre-aggregated sums of breaches and total over groupings of the
+    provider dimensions.
+
+    Each grouping is stored as dense NumPy arrays with one axis per
+    dimension, indexed by category code. A query picks the smallest stored
+    grouping containing the dimensions it needs, slices it by the filters
+    and sums the remaining axes, without touching row level data.
+
+    Parameters
+    ----------
+    - df : Dataframe
+        Output of get_provider_data() or a frame with the same layout.
+    - groupings : list of tuples, optional
+        Combinations of CUBE_DIMENSIONS to precompute.
+        The default is DEFAULT_GROUPINGS.
+
+    Examples
+    --------
+    >>> cube = ProviderCube(get_provider_data())
+    >>> cube.query(by=['month'], filters={'standard': 'FDS'})
+    >>> cube.query(by=['org_code'], filters={'standard': 'RTT',
+    ...                                      'start_month': '2022-10-01'})
+    """
+
+    def __init__(self, df, groupings=DEFAULT_GROUPINGS):
+        # dimension -> labels along its axis, and the code of each row
+        self._labels = {}
+        codes = {}
+        for dim in CUBE_DIMENSIONS:
+            if dim == 'month':
+                # Months are sorted so a month range is a slice of the axis
+                dim_codes, labels = pd.factorize(df.index, sort=True)
+            elif isinstance(df[dim].dtype, pd.CategoricalDtype):
+                dim_codes = df[dim].cat.codes.to_numpy()
+                labels = df[dim].cat.categories
+                # The shared categories include values df does not have,
+                # keep the axis to those present
+                used = np.unique(dim_codes[dim_codes >= 0])
+                if len(used) < len(labels):
+                    remap = np.full(len(labels) + 1, -1, dtype=np.int64)
+                    remap[used] = np.arange(len(used))
+                    dim_codes, labels = remap[dim_codes], labels[used]
+            else:
+                dim_codes, labels = pd.factorize(df[dim])
+            self._labels[dim] = pd.Index(labels)
+            codes[dim] = dim_codes
+
+        # Values present in each dimension, for validating filters
+        self._present = {dim: set(self._labels[dim][np.unique(dim_codes[dim_codes >= 0])])
+                         for dim, dim_codes in codes.items()}
+
+        breaches = df['breaches'].to_numpy()
+        total = df['total'].to_numpy()
+
+        # grouping -> {'breaches': array, 'total': array, 'rows': array}
+        self.cuboids = {}
+        # Build the largest groupings first so smaller ones can be
+        # reduced from them instead of from the rows
+        for dims in sorted((tuple(g) for g in groupings), key=self._size, reverse=True):
+            parent = self._covering(dims)
+            if parent is not None:
+                self.cuboids[dims] = self._reduce(parent, dims)
+                continue
+            shape = tuple(len(self._labels[dim]) for dim in dims)
+            valid = np.logical_and.reduce([codes[dim] >= 0 for dim in dims])
+            flat = np.ravel_multi_index([codes[dim][valid] for dim in dims], shape)
+            size = int(np.prod(shape))
+            self.cuboids[dims] = {
+                'breaches': np.bincount(flat, weights=breaches[valid], minlength=size)
+                              .astype(np.int64).reshape(shape),
+                'total': np.bincount(flat, weights=total[valid], minlength=size)
+                           .astype(np.int64).reshape(shape),
+                'rows': np.bincount(flat, minlength=size).reshape(shape)
+            }
+
+    def _size(self, dims):
+        return int(np.prod([len(self._labels[dim]) for dim in dims]))
+
+    def _covering(self, dims):
+        """Returns the smallest stored grouping containing all of dims."""
+        candidates = [g for g in self.cuboids if set(dims) <= set(g)]
+        if not candidates:
+            return None
+        return min(candidates, key=self._size)
+
+    def _reduce(self, parent, dims):
+        """Sums a stored grouping down to dims, with axes in the order of dims."""
+        axes = tuple(i for i, dim in enumerate(parent) if dim not in dims)
+        kept = [dim for dim in parent if dim in dims]
+        order = [kept.index(dim) for dim in dims]
+        return {name: np.transpose(array.sum(axis=axes), order)
+                for name, array in self.cuboids[parent].items()}
+
+    def _filter_codes(self, filters, strict):
+        """Returns dimension -> codes to keep for a filter_data() filters dict."""
+        codes = {}
+        if 'start_month' in filters or 'end_month' in filters:
+            months = self._labels['month']
+            first, last = 0, len(months)
+            if 'start_month' in filters:
+                first = months.searchsorted(pd.Timestamp(filters['start_month']), 'left')
+            if 'end_month' in filters:
+                last = months.searchsorted(pd.Timestamp(filters['end_month']), 'right')
+            codes['month'] = np.arange(first, max(first, last))
+
+        for key, dim in FILTER_COLUMNS.items():
+            if key not in filters:
+                continue
+            present = None if key == 'standard' else self._present[dim]
+            keep = _resolve_filter(None, key, filters[key],
+                                   strict=strict, present=present)
+            dim_codes = self._labels[dim].get_indexer(keep)
+            codes[dim] = dim_codes[dim_codes >= 0]
+        return codes
+
+    def query(self, by=('month',), filters={}, strict=False):
+        """
+        Sums breaches and total grouped by some dimensions.
+
+        Parameters
+        ----------
+        - by : list, optional
+            Dimensions to group by, from CUBE_DIMENSIONS. An empty list
+            gives the grand total. The default is ['month'].
+        - filters : Dictionary, optional
+            Filters in the format used by filter_data().
+        - strict : bool, optional
+            As in filter_data(). The default is False.
+
+        Raises
+        ------
+        ValueError
+            If no precomputed grouping contains the dimensions in by and
+            filters, or if a filter value is not valid (see filter_data()).
+
+        Returns
+        -------
+        - df : Dataframe
+            breaches, total and proportion_breaches for each combination of
+            the by dimensions which has data, indexed by the by dimensions.
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        codes = self._filter_codes(filters, strict)
+
+        needed = set(by) | set(codes)
+        dims = self._covering(needed)
+        if dims is None:
+            raise ValueError(f'No precomputed grouping contains {sorted(needed)}, '
+                             + f'available groupings are {list(self.cuboids)}')
+
+        arrays = dict(self.cuboids[dims])
+        for axis, dim in enumerate(dims):
+            if dim in codes:
+                arrays = {name: np.take(array, codes[dim], axis=axis)
+                          for name, array in arrays.items()}
+
+        # Sum the axes not grouped by, then put the rest in the order of by
+        sum_axes = tuple(i for i, dim in enumerate(dims) if dim not in by)
+        kept = [dim for dim in dims if dim in by]
+        order = [kept.index(dim) for dim in by]
+        arrays = {name: np.transpose(array.sum(axis=sum_axes), order)
+                  for name, array in arrays.items()}
+
+        data = {name: array.ravel() for name, array in arrays.items()}
+        if by:
+            labels = [self._labels[dim][codes[dim]] if dim in codes else self._labels[dim]
+                      for dim in by]
+            index = pd.MultiIndex.from_product(labels, names=by)
+            if len(by) == 1:
+                index = index.get_level_values(0)
+        else:
+            index = pd.RangeIndex(1)
+
+        result = pd.DataFrame({'breaches': data['breaches'], 'total': data['total']},
+                              index=index)
+        # Leave out combinations with no rows, as a groupby would
+        result = result[data['rows'] > 0]
+
+        total = result['total'].to_numpy()
+        result['proportion_breaches'] = np.divide(
+            result['breaches'].to_numpy(), total,
+            out=np.full(len(result), np.nan), where=total != 0)
+        return result
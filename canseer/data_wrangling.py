@@ -1,14 +1,231 @@
+import concurrent.futures
+import functools
+import multiprocessing
+import os
+import threading
+import time
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+from canseer.catalog import build_catalog, get_catalog
+from canseer.download_cache import cached_download
+from canseer.instrumentation import stage
+from canseer.resources import lookup_table
+from canseer.trusts import trust_directory
+
+# link to provider data set
+PROVIDER_DATA_LINK = (
+    r'https://www.england.nhs.uk/statistics/wp-content/'
+    'uploads/sites/2/2023/12/'
+    'CWT-CRS-2022-23-Data-Extract-Provider-Final.xlsx'
+)
+
+# link to national data set
+NATIONAL_DATA_LINK = (
+    r'https://www.england.nhs.uk/statistics/wp-content/'
+    'uploads/sites/2/2023/12/'
+    'CWT-CRS-National-Time-Series-Oct-2009-Oct-2023-with-'
+    'Revisions.xlsx'
+)
+
+# Columns read from the provider workbook
+PROVIDER_COLUMNS = ['PERIOD', 'STANDARD', 'ORG CODE',
+                    'TREATMENT MODALITY', 'CANCER TYPE',
+                    'STAGE/ROUTE', 'TOTAL', 'WITHIN STANDARD', 'BREACHES']
+
+# Dictionary to map old column names to new column names
+RENAME_COLS = {
+    'STANDARD': 'standard',
+    'ORG CODE': 'org_code',
+    'TOTAL': 'total',
+    'CANCER TYPE': 'cancer_type',
+    'STAGE/ROUTE': 'stage_or_route',
+    'TREATMENT MODALITY': 'treatment_modality',
+    'WITHIN STANDARD': 'within_standard',
+    'BREACHES': 'breaches'
+}
+
+# Dictionary to rename values
+VALUES_CHANGE = {
+    'cancer_type': {
+        'Exhibited (non-cancer) breast symptoms - cancer not initially suspected': 'Unsuspected_breast_ca',
+        'Missing or Invalid': 'Invalid',
+        'Suspected breast cancer': 'Suspected_breast_ca',
+        'Suspected gynaecological cancer': 'Suspected_gynecological_ca',
+        'Suspected lower gastrointestinal cancer': 'Suspected_lower_GI_ca',
+        'Suspected acute leukaemia': 'Suspected_acute_leukaemia',
+        'Suspected brain/central nervous system tumours': 'Suspected_brain_CNS_ca',
+        "Suspected children's cancer": 'Suspected_children_ca',
+        'Suspected haematological malignancies (excluding acute leukaemia)': 'Suspected_hematological_ca',
+        'Suspected head & neck cancer': 'Suspected_head_neck_ca',
+        'Suspected lung cancer': 'Suspected_lung_ca',
+        'Suspected other cancer': 'Suspected_other_ca',
+        'Suspected sarcoma': 'Suspected_sarcoma',
+        'Suspected skin cancer': 'Suspected_skin_ca',
+        'Suspected testicular cancer': 'Suspected_testicular_ca',
+        'Suspected upper gastrointestinal cancer': 'Suspected_upper_GI_ca',
+        'Suspected urological malignancies (excluding testicular)': 'Suspected_urological_ca',
+        'Breast': 'Breast',
+        'Gynaecological': 'Gynecological',
+        'Haematological': 'Hematological',
+        'Head & Neck': 'Head_Neck',
+        'Lower Gastrointestinal': 'Lower_GI',
+        'Lung': 'Lung',
+        'Other (a)': 'Other',
+        'Skin': 'Skin',
+        'Upper Gastrointestinal': 'Upper_GI',
+        'Urological': 'Urological',
+        'ALL CANCERS': 'All_Cancers'
+    },
+    'treatment_modality': {
+        'ALL MODALITIES': 'all',
+        'Anti-cancer drug regimen': 'anticancer_drug',
+        'Other': 'other',
+        'Radiotherapy': 'radiotherapy',
+        'Surgery': 'surgery'
+    },
+    'stage_or_route': {
+        ('BREAST SYMPTOMATIC, CANCER NOT SUSPECTED'): 'breast_symptom_non_cancer',
+        'NATIONAL SCREENING PROGRAMME': 'screening',
+        'URGENT SUSPECTED CANCER': 'urgent_suspected_cancer',
+        'First Treatment': 'first_treatment',
+        'Subsequent Treatment': 'subsequent_treatment',
+        'Breast Symptomatic': 'breast_symptom',
+        'Consultant Upgrade': 'consultant_upgrade',
+        'Screening': 'screening',
+        'Urgent Suspected Cancer': 'urgent_suspected_cancer'
+    }
+}
+
+# Explain NaN value in treatment modality
+RECODE_NAN = {'treatment_modality': 'not_applicable_FDS'}
+
+# Categories of the categorical columns, shared by the provider and national
+# frames so frames from any loader concatenate without becoming object
+# columns. org_code also has every trust code of geographic_etr.csv,
+# see category_dtype().
+CATEGORIES = {
+    'standard': ['28-day FDS', '31-day Combined', '62-day Combined'],
+    'org_code': ['NAT'],
+    'cancer_type': (sorted(set(VALUES_CHANGE['cancer_type'].values()))
+                    + ['all_national_data']),
+    'treatment_modality': (sorted(set(VALUES_CHANGE['treatment_modality'].values()))
+                           + ['not_applicable_FDS', 'not_applicable_national_data']),
+    'stage_or_route': (sorted(set(VALUES_CHANGE['stage_or_route'].values()))
+                       + ['not_applicable_national_data'])
+}
+
+# column -> fixed CategoricalDtype, built once by _fixed_dtype()
+_category_dtypes = {}
+_categories_lock = threading.Lock()
+
+
+def _fixed_dtype(column):
+    """The CategoricalDtype of CATEGORIES[column], with the trusts for org_code."""
+    with _categories_lock:
+        dtype = _category_dtypes.get(column)
+        if dtype is None:
+            categories = list(CATEGORIES[column])
+            if column == 'org_code':
+                trusts = nhs_code_link()['ORG_CODE']
+                categories += sorted(set(trusts) - set(categories))
+            # Only stored once built, so a failure is retried on the next call
+            dtype = _category_dtypes[column] = pd.CategoricalDtype(categories)
+    return dtype
+
+
+def _values_of(values):
+    """The distinct non-missing values of a column or list."""
+    if isinstance(values, pd.Series) and isinstance(values.dtype, pd.CategoricalDtype):
+        codes = values.cat.codes.to_numpy()
+        return set(values.cat.categories[np.unique(codes[codes >= 0])])
+    return set(pd.Series(list(values), dtype=object).dropna())
+
+
+def category_dtype(column, values=()):
+    """
+    Returns the CategoricalDtype loaders give column.
+
+    The categories are fixed: CATEGORIES[column], and for org_code every
+    trust of geographic_etr.csv after 'NAT'. Any of values not among them,
+    e.g. a trust missing from geographic_etr.csv, is added after the fixed
+    categories in sorted order, so the same values always give the same
+    dtype whichever process or order they are loaded in.
+    """
+    dtype = _fixed_dtype(column)
+    extra = _values_of(values) - set(dtype.categories)
+    if not extra:
+        return dtype
+    return pd.CategoricalDtype(list(dtype.categories) + sorted(extra))
+
+
+def apply_categories(df):
+    """
+    Casts the columns of df named in CATEGORIES to the shared
+    CategoricalDtypes, see category_dtype().
+    Categorical columns are recoded through their categories only.
+
+    Parameters
+    ----------
+    - df : Dataframe
+        Provider or national dataframe.
+
+    Returns
+    -------
+    - df : Dataframe
+        A new dataframe with the shared categories.
+    """
+    columns = {}
+    for column in CATEGORIES:
+        if column not in df.columns:
+            continue
+        values = df[column]
+        if not isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype('category')
+        columns[column] = values.astype(category_dtype(column, values))
+    return df.assign(**columns)
+
+
+def concat_frames(frames, **kwargs):
+    """
+    pd.concat() for provider and national frames which keeps the
+    categorical columns categorical, e.g. national data appended to
+    provider data. Frames with only the fixed categories concatenate as
+    categoricals with pd.concat() too; concat_frames() also handles frames
+    with values outside them, giving every frame the categories of all.
 
-def get_provider_data():
+    Parameters
+    ----------
+    - frames : list of Dataframes
+    - **kwargs
+        Passed to pd.concat().
+
+    Returns
+    -------
+    - df : Dataframe
+    """
+    frames = list(frames)
+    dtypes = {}
+    for column in CATEGORIES:
+        values = set()
+        for frame in frames:
+            if column in frame.columns:
+                values |= _values_of(frame[column])
+        dtypes[column] = category_dtype(column, values)
+    return pd.concat([frame.astype({column: dtype for column, dtype in dtypes.items()
+                                    if column in frame.columns})
+                      for frame in frames], **kwargs)
+
+
+def get_provider_data(data_link=PROVIDER_DATA_LINK):
     """
     Returns the provider dataframe
     
     Parameters
     ----------
-    - None
+    - data_link : str, optional
+        URL or local path of the provider workbook. Downloads are kept in
+        the local cache, see canseer.download_cache.
+        The default is PROVIDER_DATA_LINK.
     
     Returns
     -------
@@ -19,122 +236,174 @@ def get_provider_data():
         the number of referrals meeting the standard and the number of breaches.
         Data is recorded for each month from April 2022 to March 2023.
     """
-    # link to provider data set
-    provider_data_link = (
-        r'https://www.england.nhs.uk/statistics/wp-content/'
-        'uploads/sites/2/2023/12/'
-        'CWT-CRS-2022-23-Data-Extract-Provider-Final.xlsx'
-    )
-
-    # Dictionary to map old column names to new column names
-    rename_cols = {
-        'STANDARD': 'standard',
-        'ORG CODE': 'org_code',
-        'TOTAL': 'total',
-        'CANCER TYPE': 'cancer_type',
-        'STAGE/ROUTE': 'stage_or_route',
-        'TREATMENT MODALITY': 'treatment_modality',
-        'WITHIN STANDARD': 'within_standard',
-        'BREACHES': 'breaches'
-    }
-
-    # Dictionary to rename values
-    values_change = {
-        'cancer_type': {
-            'Exhibited (non-cancer) breast symptoms - cancer not initially suspected': 'Unsuspected_breast_ca',
-            'Missing or Invalid': 'Invalid',
-            'Suspected breast cancer': 'Suspected_breast_ca',
-            'Suspected gynaecological cancer': 'Suspected_gynecological_ca',
-            'Suspected lower gastrointestinal cancer': 'Suspected_lower_GI_ca',
-            'Suspected acute leukaemia': 'Suspected_acute_leukaemia',
-            'Suspected brain/central nervous system tumours': 'Suspected_brain_CNS_ca',
-            "Suspected children's cancer": 'Suspected_children_ca',
-            'Suspected haematological malignancies (excluding acute leukaemia)': 'Suspected_hematological_ca',
-            'Suspected head & neck cancer': 'Suspected_head_neck_ca',
-            'Suspected lung cancer': 'Suspected_lung_ca',
-            'Suspected other cancer': 'Suspected_other_ca',
-            'Suspected sarcoma': 'Suspected_sarcoma',
-            'Suspected skin cancer': 'Suspected_skin_ca',
-            'Suspected testicular cancer': 'Suspected_testicular_ca',
-            'Suspected upper gastrointestinal cancer': 'Suspected_upper_GI_ca',
-            'Suspected urological malignancies (excluding testicular)': 'Suspected_urological_ca',
-            'Breast': 'Breast',
-            'Gynaecological': 'Gynecological',
-            'Haematological': 'Hematological',
-            'Head & Neck': 'Head_Neck',
-            'Lower Gastrointestinal': 'Lower_GI',
-            'Lung': 'Lung',
-            'Other (a)': 'Other',
-            'Skin': 'Skin',
-            'Upper Gastrointestinal': 'Upper_GI',
-            'Urological': 'Urological',
-            'ALL CANCERS': 'All_Cancers'
-        },
-        'treatment_modality': {
-            'ALL MODALITIES': 'all',
-            'Anti-cancer drug regimen': 'anticancer_drug',
-            'Other': 'other',
-            'Radiotherapy': 'radiotherapy',
-            'Surgery': 'surgery'
-        },
-        'stage_or_route': {
-            ('BREAST SYMPTOMATIC, CANCER NOT SUSPECTED'): 'breast_symptom_non_cancer',
-            'NATIONAL SCREENING PROGRAMME': 'screening',
-            'URGENT SUSPECTED CANCER': 'urgent_suspected_cancer',
-            'First Treatment': 'first_treatment',
-            'Subsequent Treatment': 'subsequent_treatment',
-            'Breast Symptomatic': 'breast_symptom',
-            'Consultant Upgrade': 'consultant_upgrade',
-            'Screening': 'screening',
-            'Urgent Suspected Cancer': 'urgent_suspected_cancer'
-        }
-    }
-
-    # Explain NaN value in treatment modality
-    recode_nan = {'treatment_modality': 'not_applicable_FDS'}
-
-    # Read data from Excel stating which columns to use, rename columns and
-    # assign variable types
-    df = (
-        pd.read_excel(
-            provider_data_link,
-            usecols=['PERIOD', 'STANDARD', 'ORG CODE',
-                     'TREATMENT MODALITY', 'CANCER TYPE',
-                     'STAGE/ROUTE', 'TOTAL', 'WITHIN STANDARD', 'BREACHES'
-                    ],
+    # Read data from Excel stating which columns to use
+    path = cached_download(data_link)
+    with stage('provider.read_excel') as current:
+        raw = pd.read_excel(
+            path,
+            usecols=PROVIDER_COLUMNS,
             index_col='PERIOD',
             parse_dates=True
         )
-        .rename(columns=rename_cols)
-        .astype({
-            'total': np.int32,
-            'within_standard': np.int32,
-            'breaches': np.int32
-        })
-        .fillna(value=recode_nan)
-        .assign(
-            standard=lambda x: pd.Categorical(x['standard']),
-            cancer_type=lambda x: pd.Categorical(x['cancer_type']),
-            treatment_modality=lambda x: pd.Categorical(x['treatment_modality']),
-            org_code=lambda x: pd.Categorical(x['org_code']),
-            stage_or_route=lambda x: pd.Categorical(x['stage_or_route'])
+        current.rows_out = len(raw)
+
+    # Rename columns and assign variable types
+    with stage('provider.coerce', rows_in=len(raw)) as current:
+        df = (
+            raw
+            .rename(columns=RENAME_COLS)
+            .astype({
+                'total': np.int32,
+                'within_standard': np.int32,
+                'breaches': np.int32
+            })
+            .fillna(value=RECODE_NAN)
+            .assign(
+                standard=lambda x: pd.Categorical(x['standard']),
+                cancer_type=lambda x: pd.Categorical(x['cancer_type']),
+                treatment_modality=lambda x: pd.Categorical(x['treatment_modality']),
+                org_code=lambda x: pd.Categorical(x['org_code']),
+                stage_or_route=lambda x: pd.Categorical(x['stage_or_route'])
+            )
+            .replace(VALUES_CHANGE)
+            .pipe(apply_categories)
         )
-        .replace(values_change)
+
+        # Rename the index to month
+        df.index.name = 'month'
+        current.rows_out = len(df)
+
+    # Row counts of each month and value, for validating filters
+    build_catalog(df)
+    return df
+    
+
+# Column block of the "Monthly Performance" sheet for each national standard
+# and the treatment modality label it is given
+NATIONAL_STANDARDS = {
+    '28-day FDS': {'suffix': '', 'treatment_modality': 'not_applicable_FDS'},
+    '31-day Combined': {'suffix': '.1',
+                        'treatment_modality': 'not_applicable_national_data'},
+    '62-day Combined': {'suffix': '.2',
+                        'treatment_modality': 'not_applicable_national_data'}
+}
+
+
+@stage('national.read_excel')
+def _read_national_sheet(path):
+    """Parses the "Monthly Performance" sheet once for all three standards."""
+    usecols = ['Monthly']
+    for standard in NATIONAL_STANDARDS.values():
+        usecols += [col + standard['suffix']
+                    for col in ('Total', 'Within Standard', 'Outside Standard')]
+
+    return pd.read_excel(
+        path,
+        sheet_name="Monthly Performance",
+        skiprows=range(0, 3),
+        usecols=usecols,
+        index_col='Monthly',
+        parse_dates=True
     )
 
-    # Rename the index to month
+
+def _national_standard_block(sheet, standard):
+    """
+    Returns the total, within_standard and breaches columns of one
+    standard from the parsed national sheet.
+    """
+    suffix = NATIONAL_STANDARDS[standard]['suffix']
+
+    # Dictionary of columns to rename
+    column_names = {f'Total{suffix}': 'total',
+                    f'Within Standard{suffix}': 'within_standard',
+                    f'Outside Standard{suffix}': 'breaches'}
+
+    df = sheet.loc[:, list(column_names)]
+
+    # The 31 and 62 day standards have months recorded before the standard
+    # was reported, recode NaN as 0 and drop the rows with no referrals
+    if standard != '28-day FDS':
+        df = df.fillna(0)
+    df = df.astype(np.int32).rename(columns=column_names)
+    if standard != '28-day FDS':
+        df = df.drop(df[df['total'] == 0].index)
+
+    # Add extra columns, Org code so its clear if appended to the provider data frame.
+    df = df.assign(org_code='NAT',
+                   standard=standard,
+                   cancer_type='all_national_data',
+                   treatment_modality=NATIONAL_STANDARDS[standard]['treatment_modality'],
+                   stage_or_route='not_applicable_national_data')
+    return df
+
+
+@functools.lru_cache(maxsize=4)
+@stage('national.build')
+def _national_long(path, modified):
+    """
+    Builds the long format national frame. Cached on the local path and
+    modification time of the workbook so a changed file is parsed again.
+    """
+    sheet = _read_national_sheet(path)
+    df = pd.concat([_national_standard_block(sheet, standard)
+                    for standard in NATIONAL_STANDARDS])
+
+    # columns are categories, shared with the provider data
+    df = apply_categories(df)
+    # names index of df as month
     df.index.name = 'month'
+    return df
+
 
+def get_national_data(data_link=NATIONAL_DATA_LINK):
+    """
+    Creates a national dataframe for the 28, 31 and 62 day standards.
+    The workbook is parsed once and the result is reused by later calls
+    and by the get_national_*_day_standard functions.
+
+    Parameters
+    ----------
+    - data_link : str, optional
+        URL or local path of the national time series workbook.
+        The default is NATIONAL_DATA_LINK.
+
+    Returns
+    -------
+    - df - Dataframe
+        Long format data frame with the total referrals, number of breaches
+        and number within standard per month for each standard. The standard
+        column holds '28-day FDS', '31-day Combined' or '62-day Combined'.
+        Organisation code for the national data set is recorded as NAT.
+        Suitable to be appended to provider data.
+
+    """
+    path = cached_download(data_link)
+    df = _national_long(path, os.path.getmtime(path)).copy()
+    build_catalog(df)
     return df
-    
 
-def get_national_28_day_standard():
+
+def _national_standard_view(data_link, standard):
+    """Rows of get_national_data() for one standard."""
+    path = cached_download(data_link)
+    df = _national_long(path, os.path.getmtime(path))
+    # The categories stay the shared ones, so the standards and provider
+    # data concatenate as categoricals
+    df = df.loc[df['standard'] == standard].copy()
+    build_catalog(df)
+    return df
+
+
+def get_national_28_day_standard(data_link=NATIONAL_DATA_LINK):
     """
     Creates a national dataframe for the 28 day standard.
 
     Parameters
     ----------
-    - None
+    - data_link : str, optional
+        URL or local path of the national time series workbook.
+        The default is NATIONAL_DATA_LINK.
 
     Returns
     -------
@@ -146,62 +415,18 @@ def get_national_28_day_standard():
     data.
 
     """
-    # link to national data set
-    national_data_link = (
-        r'https://www.england.nhs.uk/statistics/wp-content/'
-        'uploads/sites/2/2023/12/'
-        'CWT-CRS-National-Time-Series-Oct-2009-Oct-2023-with-'
-        'Revisions.xlsx'
-    )
-    
-    # Dictionary of columns to rename
-    column_names = {
-        'Outside Standard': 'breaches',
-        'Within Standard': 'within_standard',
-        'Total': 'total'
-    }
-    
-    # read the excel file, including a specific sheet number and columns required,
-    # assigns types, and renames columns.
-    df = (
-        pd.read_excel(
-            national_data_link,
-            sheet_name="Monthly Performance",
-            skiprows=range(0, 3),
-            usecols=['Monthly', 'Total', 'Within Standard', 'Outside Standard'],
-            index_col='Monthly',
-            parse_dates=True
-        )
-        .astype({'Total': np.int32, 'Within Standard': np.int32, 'Outside Standard': np.int32})
-        .rename(columns=column_names)
-    )
+    return _national_standard_view(data_link, '28-day FDS')
 
-    # Add extra columns, Org code so its clear if appended to the provider data frame.
-    df['org_code'] = 'NAT'
-    df['standard'] = '28-day FDS'
-    df['cancer_type'] = 'all_national_data'
-    df['treatment_modality'] = 'not_applicable_FDS'
-    df['stage_or_route'] = 'not_applicable_national_data'
-    # columns are categories 
-    df = df.assign(
-        org_code=lambda x: pd.Categorical(x['org_code']),
-        standard=lambda x: pd.Categorical(x['standard']),
-        cancer_type=lambda x: pd.Categorical(x['cancer_type']),
-        treatment_modality=lambda x: pd.Categorical(x['treatment_modality']),
-        stage_or_route=lambda x: pd.Categorical(x['stage_or_route'])
-    )
-    # names index of df as month
-    df.index.name = 'month'
-    return df
 
-
-def get_national_31_day_standard():
+def get_national_31_day_standard(data_link=NATIONAL_DATA_LINK):
     """
     Creates a national dataframe for the 31 day standard
 
     Parameters
     ----------
-    - None
+    - data_link : str, optional
+        URL or local path of the national time series workbook.
+        The default is NATIONAL_DATA_LINK.
 
     Returns
     -------
@@ -213,69 +438,18 @@ def get_national_31_day_standard():
     data.
 
     """
-    # URL for national data
-    national_data_link = (
-        r'https://www.england.nhs.uk/statistics/wp-content/'
-        'uploads/sites/2/2023/12/'
-        'CWT-CRS-National-Time-Series-Oct-2009-Oct-2023-with-'
-        'Revisions.xlsx'
-    )
-    
-    # Dictionary of columns to rename
-    column_names = {'Outside Standard.1': 'breaches',
-                    'Within Standard.1': 'within_standard',
-                    'Total.1': 'total'}
-    
-    # Dictionary to recode NaN values as 0
-    recoding = {'Total.1': 0,
-                'Within Standard.1': 0,
-                'Outside Standard.1': 0}
-    
-    # Read the excel file, including specific sheet number and columns required,
-    # assigns variable types, and renames columns, fills in NAN values.
-    df = (
-        pd.read_excel(
-            national_data_link,
-            sheet_name="Monthly Performance",
-            skiprows=range(0, 3),
-            usecols=['Monthly', 'Total.1', 'Within Standard.1', 'Outside Standard.1'],
-            index_col='Monthly',
-            parse_dates=True
-        )
-        .fillna(value=recoding)
-        .astype({'Total.1': np.int32, 'Within Standard.1': np.int32, 'Outside Standard.1': np.int32})
-        .rename(columns=column_names)
-    )
+    return _national_standard_view(data_link, '31-day Combined')
 
-    # Drop the rows where there is month recorded but no data on referrals
-    df = df.drop(df[df['total'] == 0].index)
-    
-    # Add extra columns so its clear if appended to the provider data frame.
-    df['org_code'] = 'NAT'
-    df['standard'] = '31-day Combined'
-    df['cancer_type'] = 'all_national_data'
-    df['treatment_modality'] = 'not_applicable_national_data'
-    df['stage_or_route'] = 'not_applicable_national_data'
-    # columns are catergories 
-    df = df.assign(
-        org_code=lambda x: pd.Categorical(x['org_code']),
-        standard=lambda x: pd.Categorical(x['standard']),
-        cancer_type=lambda x: pd.Categorical(x['cancer_type']),
-        treatment_modality=lambda x: pd.Categorical(x['treatment_modality']),
-        stage_or_route=lambda x: pd.Categorical(x['stage_or_route'])
-    )
-    # names index of df as month 
-    df.index.name = 'month'
-    
-    return df
 
-def get_national_62_day_standard():
+def get_national_62_day_standard(data_link=NATIONAL_DATA_LINK):
     """
     Creates a national dataframe for the 62 day standard
     
     Parameters
     ----------
-    - None
+    - data_link : str, optional
+        URL or local path of the national time series workbook.
+        The default is NATIONAL_DATA_LINK.
 
     Returns
     -------
@@ -287,63 +461,134 @@ def get_national_62_day_standard():
         data.
 
     """
-    
-    # URL for national data
-    national_data_link = (
-        r'https://www.england.nhs.uk/statistics/wp-content/'
-        'uploads/sites/2/2023/12/'
-        'CWT-CRS-National-Time-Series-Oct-2009-Oct-2023-with-'
-        'Revisions.xlsx'
-    )
-    
-    # Dictionary of columns to rename
-    column_names = {'Outside Standard.2': 'breaches',
-                    'Within Standard.2': 'within_standard',
-                    'Total.2': 'total'}
-    
-    # Dictionary to recode NaN values as 0
-    recoding = {'Total.2': 0,
-                'Within Standard.2': 0,
-                'Outside Standard.2': 0}
-    
-    # Read the excel file, including specific sheet number and columns required,
-    # assigns variable types and renames columns.
-    df = (
-        pd.read_excel(
-            national_data_link,
-            sheet_name="Monthly Performance",
-            skiprows=range(0, 3),
-            usecols=['Monthly', 'Total.2', 'Within Standard.2', 'Outside Standard.2'],
-            index_col='Monthly',
-            parse_dates=True
-        )
-        .fillna(value=recoding)
-        .astype({'Total.2': np.int32, 'Within Standard.2': np.int32, 'Outside Standard.2': np.int32})
-        .rename(columns=column_names)
-    )
+    return _national_standard_view(data_link, '62-day Combined')
+
+# Exceptions raised when a wait in load_data() runs out of time
+_TIMEOUT_ERRORS = (TimeoutError, concurrent.futures.TimeoutError,
+                   multiprocessing.TimeoutError)
+
+
+@stage('load_data')
+def load_data(provider_link=PROVIDER_DATA_LINK, national_link=NATIONAL_DATA_LINK,
+              timeout=None, processes=True):
+    """
+    Loads the provider and national datasets at the same time.
+
+    Both workbooks are downloaded in threads (see canseer.download_cache),
+    and each is parsed in its own worker process as soon as its download
+    finishes, so the total time is about that of the slower dataset.
+
+    Parameters
+    ----------
+    - provider_link : str, optional
+        URL or local path of the provider workbook.
+        The default is PROVIDER_DATA_LINK.
+    - national_link : str, optional
+        URL or local path of the national workbook.
+        The default is NATIONAL_DATA_LINK.
+    - timeout : float, optional
+        Seconds to wait for both datasets. The default is None (no limit).
+    - processes : bool, optional
+        Parse in worker processes. If False the workbooks are parsed in
+        threads, which avoids starting processes but holds the GIL while
+        parsing. The default is True.
+
+    Raises
+    ------
+    TimeoutError
+        If the datasets are not loaded within timeout. Worker processes are
+        stopped; a download still running finishes in the background
+        (each request has the DOWNLOAD_TIMEOUT of canseer.download_cache)
+        and is cached for the next call.
+    Exception
+        The first error raised downloading or parsing either dataset, e.g.
+        urllib.error.URLError or FileNotFoundError. The other dataset's
+        work is cancelled.
+
+    Returns
+    -------
+    - provider : Dataframe
+        As returned by get_provider_data().
+    - national : Dataframe
+        As returned by get_national_data().
+
+    Examples
+    --------
+    >>> provider, national = load_data(timeout=600)
+    >>> combined = concat_frames([provider, national])
+    """
+    loaders = {'provider': (provider_link, get_provider_data),
+               'national': (national_link, get_national_data)}
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    def remaining():
+        return None if deadline is None else max(deadline - time.monotonic(), 0)
+
+    # Start the worker processes before any thread, forking a process with
+    # running threads can deadlock
+    pool = multiprocessing.Pool(len(loaders)) if processes else None
+    threads = concurrent.futures.ThreadPoolExecutor(len(loaders))
+    results = {}
+    # Futures of the thread pool, cancelled if loading stops early
+    futures = []
+    parses = {}
+    try:
+        downloads = {threads.submit(cached_download, link): name
+                     for name, (link, _) in loaders.items()}
+        futures.extend(downloads)
+        for download in concurrent.futures.as_completed(downloads, timeout=remaining()):
+            name = downloads[download]
+            path = download.result()
+            loader = loaders[name][1]
+            if pool is not None:
+                parses[name] = pool.apply_async(loader, (path,))
+            else:
+                parses[name] = threads.submit(loader, path)
+                futures.append(parses[name])
+
+        for name, parse in parses.items():
+            if pool is not None:
+                results[name] = parse.get(timeout=remaining())
+            else:
+                results[name] = parse.result(timeout=remaining())
+    except _TIMEOUT_ERRORS:
+        finished = {name for name, parse in parses.items()
+                    if (parse.ready() if pool is not None else parse.done())}
+        pending = [name for name in loaders if name not in finished]
+        raise TimeoutError(f'Loading the {" and ".join(pending)} data did not '
+                           + f'finish within {timeout} seconds') from None
+    finally:
+        # shutdown(cancel_futures=True) is new in Python 3.9
+        for future in futures:
+            future.cancel()
+        threads.shutdown(wait=False)
+        if pool is not None:
+            pool.terminate()
+
+    # Frames parsed in worker processes carry the categories of that
+    # process, recode them to this process's shared categories
+    provider = apply_categories(results['provider'])
+    national = apply_categories(results['national'])
+    build_catalog(provider)
+    build_catalog(national)
+    return provider, national
 
-    # Drop the rows where there is month recorded but no data on referrals
-    df = df.drop(df[df['total'] == 0].index)
-    
-    # Add extra columns so details clear if appended to the provider data frame.
-    df['org_code'] = 'NAT'
-    df['standard'] = '62-day Combined'
-    df['cancer_type'] = 'all_national_data'
-    df['treatment_modality'] = 'not_applicable_national_data'
-    df['stage_or_route'] = 'not_applicable_national_data'
-    # columns are categories 
-    df = df.assign(
-        org_code=lambda x: pd.Categorical(x['org_code']),
-        standard=lambda x: pd.Categorical(x['standard']),
-        cancer_type=lambda x: pd.Categorical(x['cancer_type']),
-        treatment_modality=lambda x: pd.Categorical(x['treatment_modality']),
-        stage_or_route=lambda x: pd.Categorical(x['stage_or_route'])
-    )
-    # names index of df as month
-    df.index.name = 'month'
-    return df
 
 #### Filters ####
+
+# Dictionary of standard in the dataframe
+STANDARD_DICT = {'FDS': '28-day FDS',
+                 'DTT': '31-day Combined',
+                 'RTT': '62-day Combined'}
+
+# filter_data() key -> column it filters
+FILTER_COLUMNS = {'standard': 'standard',
+                  'org': 'org_code',
+                  'stage_or_route': 'stage_or_route',
+                  'treatment': 'treatment_modality',
+                  'cancer_type': 'cancer_type'}
+
+@stage('select_months')
 def select_months(df, start_date='2022-04-01', end_date='2023-03-01'):
     """
     Filter data based on a time frame. 
@@ -367,6 +612,7 @@ def select_months(df, start_date='2022-04-01', end_date='2023-03-01'):
     return df
 
 
+@stage('select_org')
 def select_org(df, orgs, strict=False):
     """
     Filters data based on org codes. 
@@ -392,36 +638,35 @@ def select_org(df, orgs, strict=False):
     # list of org codes 
     
     org_list_format=[]
+    # org codes in the dataframe, found once for all orgs
+    present = _present_values(df, 'org_code')
     
     # if one org code supplied check to see if in dataframe 
     if isinstance(orgs, str):
-        if not df['org_code'].eq(orgs[:3].upper()).any():
+        if orgs[:3].upper() not in present:
             raise ValueError(
                 'Org code in org_list is not in the dataframe')
         # if in df append it to org_list_format
-        elif df['org_code'].eq(orgs).any():
-            org_list_format.append(orgs[:3].upper())
+        org_list_format.append(orgs[:3].upper())
             
     elif isinstance(orgs, list):
 
         # check to see if each string in org list is in the dataframe
         for org in orgs:
-            if not df['org_code'].eq(org[:3].upper()).any():
+            if org[:3].upper() not in present:
                 if strict:
                     raise ValueError(
                         'Org code in org_list is not in the dataframe')
-                    break
-                elif not strict:
-                    print(f'Value {org} was not in the list, continuing')
-                    continue
-            elif df['org_code'].eq(org[:3].upper()).any():
-                org_list_format.append(org[:3].upper())      
+                print(f'Value {org} was not in the list, continuing')
+                continue
+            org_list_format.append(org[:3].upper())
                 
     # Filter dataframe based on the list of org codes
     df = df[df['org_code'].isin(org_list_format)]
     return df 
 
 
+@stage('select_standard')
 def select_standard(df, standards, strict=False):
     """
     Filters dataframe based on the standard. 
@@ -456,9 +701,7 @@ def select_standard(df, standards, strict=False):
 
     """
     # Dictionary of standard in the dataframe
-    standard_dict = {'FDS': '28-day FDS',
-                     'DTT': '31-day Combined',
-                     'RTT': '62-day Combined'}
+    standard_dict = STANDARD_DICT
     standard_format = []
     error_value_message = str('Standards in standard list is not FDS,'
                         + 'DTT, or RTT\n'
@@ -469,7 +712,7 @@ def select_standard(df, standards, strict=False):
     if isinstance(standards, str):
         if standards in standard_dict:
             standard_format.append(standard_dict[standards])
-        elif standards not in standard:
+        else:
             raise ValueError(error_value_message)
 
     elif isinstance(standards, list):
@@ -490,6 +733,7 @@ def select_standard(df, standards, strict=False):
     df = df[df['standard'].isin(standard_format)]
     return df
 
+@stage('select_cancer')
 def select_cancer(df, cancer_type, strict=False):
     """
     Filters dataframe based on cancer type. 
@@ -515,9 +759,12 @@ def select_cancer(df, cancer_type, strict=False):
         Dataframe containing only cancer types in the cancer_type_list
 
     """
+    # cancer types in the dataframe
+    present = _present_values(df, 'cancer_type')
+
     # Raised error if cancer type not in df 
     if isinstance(cancer_type, str):
-        if not df['cancer_type'].eq(cancer_type).any():
+        if cancer_type not in present:
             raise ValueError(
                  f'Cancer type "{cancer_type}" are not in the dataframe')
     # returns df filtered based on cancer type 
@@ -528,24 +775,22 @@ def select_cancer(df, cancer_type, strict=False):
    # If a list of cancer type raised error 
     elif isinstance(cancer_type, list):
         # check to see if each string in the cancer type list is in the dataframe.
+        keep = []
         for can in cancer_type:
-            if not df['cancer_type'].eq(can).any():
+            if can not in present:
         # if strict is False continue to next cancer type in list otherwise break.
                 if strict:
                     raise ValueError(
                         f'Cancer type "{cancer_type}" are not in the dataframe')
-                    break
-                if not strict:
-                    print(f'Error ocurred with value "{can}", removing it and continuing')
-                    cancer_type.remove(can)
-                    continue
-            else:
+                print(f'Error ocurred with value "{can}", removing it and continuing')
                 continue
+            keep.append(can)
                 
             # filters the dataframe based on the cancer type list
-        df = df[df['cancer_type'].isin(cancer_type)]
+        df = df[df['cancer_type'].isin(keep)]
         return df
 
+@stage('select_treatment_modality')
 def select_treatment_modality(df, treatment_modality, strict=False):
     """
     Filters dataframe based on treatment modality. 
@@ -569,11 +814,13 @@ def select_treatment_modality(df, treatment_modality, strict=False):
 
     """
     error_value_message='One of the specified treatment_modality is not in the dataframe'
+    # treatment modalities in the dataframe
+    present = _present_values(df, 'treatment_modality')
 
     # if treatment modality not in df raise error otherwise filter 
     if isinstance(treatment_modality, str):
         
-        if treatment_modality not in df['treatment_modality'].unique():
+        if treatment_modality not in present:
             raise ValueError(error_value_message)
         
         else:
@@ -583,24 +830,25 @@ def select_treatment_modality(df, treatment_modality, strict=False):
  
     elif isinstance(treatment_modality, list):
         # check to see if each treatment is not in the dataframe.
+        keep = []
         for treat in treatment_modality:
-            if not df['treatment_modality'].eq(treat).any():
+            if treat not in present:
                 if strict:
                     print(f"Error occured with value '{treat}'")
                     raise ValueError(error_value_message)
-                    break
-                elif not strict:
-                    print((f"Value '{treat}' not in df, "
-                           + "continuing without it"))
-                    treatment_modality.remove(treat)
-                    continue
+                print((f"Value '{treat}' not in df, "
+                       + "continuing without it"))
+                continue
+            keep.append(treat)
+        treatment_modality = keep
                         
     # Filter dataframe based on the list of treatment modalitys
     df = df[df['treatment_modality'].isin(treatment_modality)]
     return df
 
 
-def select_stage_or_route(df, stage_or_route):
+@stage('select_stage_or_route')
+def select_stage_or_route(df, stage_or_route, strict=False):
     """
     Filters data based on stage or route of referral. 
     Parameters
@@ -612,6 +860,9 @@ def select_stage_or_route(df, stage_or_route):
      For example stage_or_route = ["screening", "urgent_suspected_cancer"]
      will include data containing screening and urgent_suspected_cancer
      referrals.
+    - strict : bool, optional
+        If True a stage/route in the list that is not in the dataframe
+        raises ValueError, otherwise it is skipped. The default is False.
 
     Raises
     ------
@@ -625,11 +876,13 @@ def select_stage_or_route(df, stage_or_route):
 
     """
     error_value_message='One of the specified stage_or_route is not in the dataframe'
+    # stages/routes in the dataframe
+    present = _present_values(df, 'stage_or_route')
     
     # if one stage/route given, check to see if it is in the df  filter df based on that stage/route 
     if isinstance(stage_or_route, str):
         
-        if stage_or_route not in df['stage_or_route'].unique():
+        if stage_or_route not in present:
             raise ValueError(error_value_message)
      # filter df based on that stage/route   
         else:
@@ -639,33 +892,261 @@ def select_stage_or_route(df, stage_or_route):
      # If a list of stage/route is given    
     elif isinstance(stage_or_route, list):
         # check to see if each stage/route is not in the dataframe, raised error messages.
+        keep = []
         for stag in stage_or_route:
-            if not df['stage_or_route'].eq(stag).any():
+            if stag not in present:
         # if criteria is strict stop function 
                 if strict:
                     print(f"Error occured with value '{stag}'")
                     raise ValueError(error_value_message)
-                    break
         # if criteria is not strict continue with the function 
-                elif not strict:
-                    print((f"Value '{stag}' not in df, "
-                           + "continuing without it"))
-                    stage_or_route.remove(stag)
-                    continue
+                print((f"Value '{stag}' not in df, "
+                       + "continuing without it"))
+                continue
+            keep.append(stag)
+        stage_or_route = keep
                         
     # Filter dataframe based on the list of stage/routes 
     df = df[df['stage_or_route'].isin(stage_or_route)]
     return df
 
 
-def filter_data(df, filters={}):
+def _present_values(df, column, rows=None):
+    """
+    Returns the set of values which occur in a column of df, or in the
+    rows at positions rows of it. For all of df they come from its catalog
+    if it has one (see canseer.catalog), otherwise from the codes.
+    """
+    if rows is None:
+        catalog = get_catalog(df)
+        if catalog is not None and column in catalog:
+            return catalog.values(column)
+    values = df[column]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = values.cat.codes.to_numpy()
+        if rows is not None:
+            codes = codes[rows]
+        counts = np.bincount(codes[codes >= 0],
+                             minlength=len(values.cat.categories))
+        return set(values.cat.categories[counts > 0])
+    if rows is not None:
+        values = values.iloc[rows]
+    return set(values.dropna().unique())
+
+
+def _filter_lookups(key, values):
+    """Returns the column values looked up for the values of one filter_data() key."""
+    if isinstance(values, str):
+        values = [values]
+    # org codes are matched on their first 3 characters in upper case
+    return [value[:3].upper() if key == 'org' else value for value in values]
+
+
+def _filter_found(key, values, present):
+    """
+    True if every value of one filter_data() key is in present, so
+    _resolve_filter() keeps them all without raising or printing.
+    """
+    if key == 'standard':
+        present = STANDARD_DICT
+    return all(lookup in present for lookup in _filter_lookups(key, values))
+
+
+def _resolve_filter(df, key, values, strict=False, present=None):
+    """
+    Validates the values of one filter_data() key and returns the
+    column values to keep, with the same rules as the select_* functions.
+    A single string which is not found raises ValueError. In a list,
+    values not found raise ValueError if strict, otherwise they are skipped.
+    present is the set of values in the column if already known.
+    """
+    column = FILTER_COLUMNS[key]
+    single = isinstance(values, str)
+    if single:
+        values = [values]
+
+    if key == 'standard':
+        present = set(STANDARD_DICT)
+    elif present is None:
+        present = _present_values(df, column)
+
+    keep = []
+    for value, lookup in zip(values, _filter_lookups(key, values)):
+        if lookup in present:
+            keep.append(STANDARD_DICT[lookup] if key == 'standard' else lookup)
+        elif single or strict:
+            if key == 'standard':
+                raise ValueError(f'Standard "{value}" is not FDS, DTT, or RTT\n'
+                                 + 'See help_with("standards")')
+            raise ValueError(f'{key} "{value}" is not in the dataframe')
+        else:
+            print(f"Value '{value}' not in df, continuing without it")
+    return keep
+
+
+def _month_test(df, start=None, end=None):
+    """
+    Returns test(rows), True for the rows at positions rows (every row if
+    rows is None) with start <= month <= end.
+    """
+    index = df.index
+
+    def test(rows):
+        months = index if rows is None else index[rows]
+        keep = np.ones(len(months), dtype=bool)
+        if start is not None:
+            keep &= months >= start
+        if end is not None:
+            keep &= months <= end
+        return keep
+    return test
+
+
+def _filter_test(df, column, keep):
+    """
+    Returns test(rows), True for the rows at positions rows (every row if
+    rows is None) with one of the values keep in column.
+    """
+    values = df[column]
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        return lambda rows: (values if rows is None else values.iloc[rows]).isin(keep).to_numpy()
+
+    # Look up each row's category code in a table of kept categories.
+    # The extra last entry is False and catches missing values (-1).
+    keep_code = np.zeros(len(values.cat.categories) + 1, dtype=bool)
+    positions = values.cat.categories.get_indexer(keep)
+    keep_code[positions[positions >= 0]] = True
+    codes = values.cat.codes.to_numpy()
+    return lambda rows: keep_code[codes if rows is None else codes[rows]]
+
+
+def _selective_rows(df, catalog, filters, month_test):
+    """
+    Evaluates filters most selective first, using the row counts of the
+    catalog of df. Returns the positions of the rows kept, or None if the
+    result might not be the one of compile_filters()'s in-order evaluation:
+    when a value is not in df, or a kept value is not in the rows left.
+    A value in the rows left passes all the filters before it, so it
+    passes validation in order too.
+    """
+    tests = []
+    if month_test is not None:
+        start, end = filters.get('start_month'), filters.get('end_month')
+        estimate = (catalog.month_rows_between(start, end)
+                    if len(catalog.month_rows) else len(df))
+        tests.append((estimate, month_test))
+
+    # column -> values kept, for the filters validated against the data
+    kept_values = {}
+    for key, column in FILTER_COLUMNS.items():
+        if key not in filters:
+            continue
+        if column not in catalog:
+            return None
+        present = catalog.values(column)
+        if not _filter_found(key, filters[key], present):
+            return None
+        keep = _resolve_filter(df, key, filters[key], present=present)
+        if key != 'standard':
+            kept_values[column] = keep
+        tests.append((catalog.rows(column, keep), _filter_test(df, column, keep)))
+
+    tests.sort(key=lambda item: item[0])
+    rows = None
+    for _, test in tests:
+        kept = test(rows)
+        rows = np.flatnonzero(kept) if rows is None else rows[kept]
+        if len(rows) == 0:
+            break
+
+    for column, keep in kept_values.items():
+        if not set(keep) <= _present_values(df, column, rows):
+            return None
+    return rows
+
+
+def compile_filters(df, filters={}, strict=False):
+    """
+    Compiles a filters dictionary into a single boolean row mask.
+
+    Filters are applied in the order filter_data() has always used:
+    start_month, end_month, standard, org, stage_or_route, treatment and
+    cancer_type. Each one is evaluated once over the categorical codes of
+    its column, only on the rows kept by the filters before it, and its
+    values are validated against those rows, so a value which none of
+    them have is not found. No intermediate dataframes are created.
+
+    If df has a catalog (see canseer.catalog) the filter keeping the
+    fewest rows is evaluated first instead, unless a value might then be
+    validated differently.
+
+    Parameters
+    ----------
+    - df : dataframe
+        dataframe to be filtered
+    - filters : Dictionary
+        Filters in the format used by filter_data().
+    - strict : bool, optional
+        If True a value in a filter list that is not in the dataframe
+        raises ValueError, otherwise it is skipped. The default is False.
+
+    Raises
+    ------
+    - ValueError
+        If a single filter value, or with strict any listed value,
+        is not in the rows kept by the filters before it.
+
+    Returns
+    -------
+    - mask : numpy.ndarray
+        Boolean array, True for the rows to keep.
+    """
+    month_test = None
+    if 'start_month' in filters or 'end_month' in filters:
+        month_test = _month_test(df, filters.get('start_month'), filters.get('end_month'))
+    n_tests = (month_test is not None) + sum(key in filters for key in FILTER_COLUMNS)
+
+    catalog = get_catalog(df)
+    selected = None
+    if catalog is not None and n_tests >= 2:
+        selected = _selective_rows(df, catalog, filters, month_test)
+
+    if selected is None:
+        # Positions of the rows kept so far, None for every row
+        rows = None
+        if month_test is not None:
+            kept = month_test(None)
+            if n_tests == 1:
+                return kept
+            rows = np.flatnonzero(kept)
+        for key, column in FILTER_COLUMNS.items():
+            if key not in filters:
+                continue
+            present = None if key == 'standard' else _present_values(df, column, rows)
+            keep = _resolve_filter(df, key, filters[key], strict=strict, present=present)
+            kept = _filter_test(df, column, keep)(rows)
+            if n_tests == 1:
+                return kept
+            rows = np.flatnonzero(kept) if rows is None else rows[kept]
+        if rows is None:
+            return np.ones(len(df), dtype=bool)
+        selected = rows
+
+    mask = np.zeros(len(df), dtype=bool)
+    mask[selected] = True
+    return mask
+
+
+@stage('filter_data')
+def filter_data(df, filters={}, strict=False):
     """
     Filters data based on filter dictionary. 
     
     Parameters
     ----------
-    - df : dataframe
-        dataframe to be filters
+    - df : dataframe or ProviderIndex
+        dataframe to be filters, or a canseer.provider_index.ProviderIndex
+        built over it for faster repeated filtering
     - filters : Dictionary 
         Filters to be applied to data.
         The following key words should be used 'start_month', 'end_month',
@@ -683,40 +1164,33 @@ def filter_data(df, filters={}):
           'org': ['RWP', 'RXQ'],
           'stage_or_route': ['subsequent_treatment'],
           'treatment': ['radiotherapy'] }
+    - strict : bool, optional
+        If True a value in a filter list that is not in the dataframe
+        raises ValueError, otherwise it is skipped. The default is False.
           
     Returns
     -------
     - df : Dataframe
        Dataframe with filers applied
 
-    """
-
-    if 'start_month' in filters:
-        df = df.loc[(df.index >= filters.get('start_month'))]
-
-    if 'end_month' in filters:
-        df = df.loc[(df.index <= filters.get('end_month'))]
-
-    if 'standard' in filters:
-        df = select_standard(df, filters.get('standard') )
-
-    if 'org' in filters:
-        df = select_org(df, filters.get('org'))
-
-    if 'stage_or_route' in filters:
-        df = select_stage_or_route(df, filters.get('stage_or_route'))
-
-    if 'treatment' in filters:
-        df = select_treatment_modality(df, filters.get('treatment'))
+    Notes
+    -----
+    The filters are combined into one mask by compile_filters() and applied
+    in a single pass. As when they were applied one after another, each
+    filter's values are validated against the rows kept by the filters
+    before it, in the order start_month, end_month, standard, org,
+    stage_or_route, treatment, cancer_type.
 
-    if 'cancer_type' in filters:
-        df = select_cancer(df, filters.get('cancer_type'))
-    return df
+    """
+    from canseer.provider_index import ProviderIndex
+    if isinstance(df, ProviderIndex):
+        return df.filter(filters, strict=strict)
+    return df[compile_filters(df, filters, strict=strict)]
 
 #### Help ####
 
 
-def name_org_code(trust_name=None, print_dict=False):
+def name_org_code(trust_name=None, print_dict=False, fuzzy=False):
     """
     Provides the organization code for each trust name.
 
@@ -726,6 +1200,10 @@ def name_org_code(trust_name=None, print_dict=False):
         The full name of the NHS Trust. Defaults to None.
     print_dict : bool, optional
         If True, prints the dictionary of names to organization codes. Defaults to False.
+    fuzzy : bool, optional
+        If True and trust_name does not match exactly, returns the code of
+        the most similar trust name, see TrustDirectory.search().
+        Defaults to False.
 
     Returns
     -------
@@ -736,13 +1214,20 @@ def name_org_code(trust_name=None, print_dict=False):
 
     Notes
     -----
-    - Trust names are case-insensitive.
-    - Trust names should match exactly for accurate organization code retrieval.
+    - Trust names are case-insensitive, and punctuation, '&' and
+      abbreviations such as 'FT' are ignored.
+    - Without fuzzy, trust names should match exactly; close names are
+      suggested if not found.
+    - The trust file is read once, see canseer.trusts.trust_directory().
 
     Examples
     --------
     >>> name_org_code('Manchester University Nhs Foundation Trust')
     'R0A'
+    >>> name_org_code('Manchester Univ NHS FT')
+    'R0A'
+    >>> name_org_code('Manchestr University', fuzzy=True)
+    'R0A'
     >>> name_org_code(print_dict=True)
     South Tyneside And Sunderland Nhs Foundation Trust: R0B
     University Hospitals Dorset Nhs Foundation Trust: R0D
@@ -750,39 +1235,39 @@ def name_org_code(trust_name=None, print_dict=False):
     {'Manchester University Nhs Foundation Trust': 'R0A', ...}
 
     """
-    # Read in file with Name and organization code from the data folder
-    use_cols = ['Name', 'Organisation Code']
-    df = pd.read_csv("canseer/data/ods_data/geographic_etr.csv", usecols=use_cols)
-
-    # Make the 'Name' column into camel case
-    df['Name'] = df['Name'].apply(lambda x: x.title())
-
-    # Create a dictionary of names to organization codes
-    name_org_code_dict = df.set_index('Name')['Organisation Code'].to_dict()
+    directory = trust_directory()
 
     if trust_name is not None:
-        # Trust_name is case-insensitive
-        trust_name = trust_name.title()
-        if trust_name not in name_org_code_dict:
-            print("Trust name not in dictionary")
-            return None
-        return name_org_code_dict[trust_name]
-    elif trust_name is None:
-        # If None input, print the dictionary line by line if print_dict is True
-        if print_dict:
-            for name, org_code in name_org_code_dict.items():
-                print(f"{name}: {org_code}")
-        return name_org_code_dict
-
-
+        org_code = directory.code(trust_name)
+        if org_code is not None:
+            return org_code
+        matches = directory.search(trust_name, limit=3)
+        if fuzzy and matches:
+            return matches[0][0]
+        print("Trust name not in dictionary")
+        if matches:
+            print("Closest trust names: "
+                  + ", ".join(name.title() for _, name, _ in matches))
+        return None
+
+    # Dictionary of names, in title case, to organization codes
+    name_org_code_dict = directory.to_dict()
+    # If None input, print the dictionary line by line if print_dict is True
+    if print_dict:
+        for name, org_code in name_org_code_dict.items():
+            print(f"{name}: {org_code}")
+    return name_org_code_dict
+
+
+@stage('nhs_code_link')
 def nhs_code_link():
     
     """This function reads a link file between the 'ORG_CODE' and NHS Trust name
     Based on NHS Digital data provided here: https://odsdatapoint.digital.nhs.uk/predefined
+    The bundled file is read once per process, see canseer.resources.lookup_table().
     """
     
-    link_data = (pd
-                 .read_csv("canseer/data/ods_data/geographic_etr.csv")
+    link_data = (lookup_table('etr')
                  .loc[:,
                       ['Organisation Code', 'Name','National Grouping',
                        'Higher Level Health Geography', 'Postcode']]
@@ -791,26 +1276,112 @@ def nhs_code_link():
     return link_data
 
 
+@stage('read_icb_sicb_coding')
 def read_icb_sicb_coding():
     """
     Reads the Integrated Care Board (ICB) codes lookup file for Sub-ICB locations
     in England from a CSV file and returns the DataFrame.
 
     The CSV file contains information mapping Sub-ICB locations to Integrated Care Boards
-    in England as of July 2022.
+    in England as of July 2022. The bundled file is read once per process,
+    see canseer.resources.lookup_table().
 
     Returns:
     pd.DataFrame: A DataFrame containing the mapping of Sub-ICB locations to
     Integrated Care Boards in England.
     """
-    icb_path = ('canseer/data/ons_shapefile/Sub_ICB_Locations_to'
-                + '_Integrated_Care_Boards_to_NHS_England'
-                + '_(Region)_(July_2022)_Lookup_in_England.csv')
-    icb_codes = pd.read_csv(icb_path)
+    icb_codes = lookup_table('icb_sicb')
     
     return icb_codes
 
 
+@functools.lru_cache(maxsize=None)
+def _org_geography():
+    nhs_link = nhs_code_link()
+    icbs = (read_icb_sicb_coding()
+            .drop_duplicates('ICB22CDH')
+            .set_index('ICB22CDH'))
+
+    hlhg = nhs_link['Higher Level Health Geography']
+    table = pd.DataFrame({
+        'hlhg': hlhg.to_numpy(),
+        'icb_code': icbs['ICB22CD'].reindex(hlhg).to_numpy(),
+        'ICB23NM': icbs['ICB22NM'].reindex(hlhg).to_numpy(),
+        'nhs_region': icbs['NHSER22NM'].reindex(hlhg).to_numpy()
+    }, index=pd.Index(nhs_link['ORG_CODE'], name='org_code'))
+    return table
+
+
+def org_geography():
+    """
+    Returns the geography of each NHS trust, built once per process.
+
+    Returns
+    -------
+    - df : Dataframe
+        Indexed by org_code, with columns
+        hlhg : Higher Level Health Geography, the ICB 3-character code
+        icb_code : ICB 9-character ONS code
+        ICB23NM : ICB name, as in the ICB shapefile
+        nhs_region : NHS England region name
+        Trusts whose ICB is not in the lookup have NaN ICB columns.
+    """
+    return _org_geography().copy()
+
+
+def geography_column(df, column='ICB23NM'):
+    """
+    Returns a geography column for the rows of df, see org_geography().
+
+    The lookup is done once per org_code category and the rows take the
+    result through their category codes, so df is not copied.
+
+    Parameters
+    ----------
+    - df : Dataframe
+        Dataframe with an org_code column.
+    - column : str, optional
+        'hlhg', 'icb_code', 'ICB23NM' or 'nhs_region'.
+        The default is 'ICB23NM'.
+
+    Returns
+    -------
+    - series : Series
+        Categorical series with the same index as df.
+    """
+    org = df['org_code']
+    if isinstance(org.dtype, pd.CategoricalDtype):
+        org_codes, orgs = org.cat.codes.to_numpy(), org.cat.categories
+    else:
+        org_codes, orgs = pd.factorize(org)
+
+    # One lookup per org, then map the row codes through it
+    geo_codes, geo_values = pd.factorize(_org_geography()[column].reindex(orgs))
+    row_codes = np.where(org_codes >= 0, geo_codes[org_codes], -1)
+    return pd.Series(pd.Categorical.from_codes(row_codes, geo_values),
+                     index=df.index, name=column)
+
+
+def attach_geography(df, columns=('hlhg', 'ICB23NM')):
+    """
+    Returns df with geography columns added as categoricals,
+    see org_geography() and geography_column().
+
+    Parameters
+    ----------
+    - df : Dataframe
+        Dataframe with an org_code column.
+    - columns : list, optional
+        Columns of org_geography() to add. The default is ('hlhg', 'ICB23NM').
+
+    Returns
+    -------
+    - df : Dataframe
+    """
+    return df.assign(**{column: geography_column(df, column)
+                        for column in columns})
+
+
 def help_with(topic=None):
     """
     Provide information and help related to cancer data.
@@ -976,6 +1547,7 @@ def help_with(topic=None):
 
 ##### Proportion of breaches ##### 
 
+@stage('proportion_breaches')
 def proportion_breaches(df, window_size=1):
     """
     Creates a proportion_breaches column in dataframe and a moving average
@@ -1002,3 +1574,84 @@ def proportion_breaches(df, window_size=1):
     df['moving_average'] = df['proportion_breaches'].rolling(window=window_size).mean()
     
     return df
+
+
+# Columns which identify one monthly series in the provider data
+SERIES_COLUMNS = ['org_code', 'standard', 'cancer_type',
+                  'treatment_modality', 'stage_or_route']
+
+
+@stage('proportion_breaches_by_series')
+def proportion_breaches_by_series(df, window_size=1, by=SERIES_COLUMNS):
+    """
+    Proportion of breaches and its moving average for every series at once.
+
+    Breaches and total are summed for each combination of the by columns
+    and month, then the proportion and moving average are calculated within
+    each series, so interleaved orgs or standards are never mixed. The input
+    dataframe is not changed.
+
+    Parameters
+    ----------
+    - df : dataframe
+        Dataframe of cancer referrals indexed by month,
+        e.g. output of get_provider_data() or filter_data()
+    - window_size : interger , optional
+        Number of months over which the moving average is taken.
+        The default is 1.
+    - by : list, optional
+        Columns identifying a series. For one series per trust use ['org_code'].
+        The default is SERIES_COLUMNS.
+
+    Returns
+    -------
+    - df : dataframe
+        One row per series and month, sorted by series then month, with the
+        by columns, breaches, total, proportion_breaches and moving_average.
+        Months with a total of 0 have a proportion_breaches of NaN, and
+        moving averages over a window including them are NaN. The window
+        covers calendar months, so a moving average over a window including
+        a month missing from the series is NaN too.
+
+    Examples
+    --------
+    >>> proportion_breaches_by_series(filter_data(df, {'standard': 'FDS'}),
+    ...                               window_size=3, by=['org_code'])
+    """
+    by = list(by)
+    month = df.index.name or 'month'
+    series = (df.groupby(by + [df.index.rename(month)], observed=True, sort=True)
+              [['breaches', 'total']].sum())
+
+    breaches = series['breaches'].to_numpy(dtype=float)
+    total = series['total'].to_numpy(dtype=float)
+    proportion = np.divide(breaches, total, out=np.full(len(series), np.nan),
+                           where=total != 0)
+
+    # Rolling mean within each series from cumulative sums. Rows are sorted
+    # by series, so each series is a contiguous block starting at `starts`.
+    n = len(series)
+    keys = series.index.droplevel(month)
+    new_series = np.ones(n, dtype=bool)
+    if n > 1:
+        new_series[1:] = keys[1:] != keys[:-1]
+    starts = np.flatnonzero(new_series)
+    position = np.arange(n) - np.repeat(starts, np.diff(np.append(starts, n)))
+
+    valid = ~np.isnan(proportion)
+    value_sum = np.concatenate([[0], np.cumsum(np.where(valid, proportion, 0))])
+    valid_count = np.concatenate([[0], np.cumsum(valid)])
+    end = np.arange(1, n + 1)
+    begin = np.maximum(end - window_size, 0)
+    full_window = (position >= window_size - 1) & (valid_count[end] - valid_count[begin] == window_size)
+    # The window's rows are consecutive months only if the first is
+    # window_size - 1 months before the last
+    months = pd.DatetimeIndex(series.index.get_level_values(month))
+    month_number = (months.year * 12 + months.month).to_numpy()
+    full_window &= month_number - month_number[begin] == window_size - 1
+    moving_average = np.where(full_window,
+                              (value_sum[end] - value_sum[begin]) / window_size, np.nan)
+
+    series = series.assign(proportion_breaches=proportion,
+                           moving_average=moving_average)
+    return series.reset_index(level=by)
@@ -0,0 +1,286 @@
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from canseer.instrumentation import stage
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+# Timeout in seconds for a single request to the NHS statistics website
+DOWNLOAD_TIMEOUT = 120
+
+# Set through set_cache_dir() / set_offline(), otherwise read from the
+# CANSEER_CACHE_DIR / CANSEER_OFFLINE environment variables
+_cache_dir = None
+_offline = None
+
+
+def get_cache_dir():
+    """
+    Returns the directory used to cache downloaded files.
+
+    Returns
+    -------
+    - path : str
+        The directory set with set_cache_dir(), otherwise the
+        CANSEER_CACHE_DIR environment variable, otherwise ~/.cache/canseer
+    """
+    if _cache_dir is not None:
+        return _cache_dir
+    env_dir = os.environ.get('CANSEER_CACHE_DIR')
+    if env_dir:
+        return env_dir
+    return os.path.join(os.path.expanduser('~'), '.cache', 'canseer')
+
+
+def set_cache_dir(path=None):
+    """
+    Sets the directory used to cache downloaded files.
+
+    Parameters
+    ----------
+    - path : str, optional
+        Directory for the cache. None restores the default location.
+    """
+    global _cache_dir
+    _cache_dir = None if path is None else os.fspath(path)
+
+
+def is_offline():
+    """
+    Returns True if downloads should be served from the cache only.
+    Offline mode is set by set_offline() or by CANSEER_OFFLINE=1.
+    """
+    if _offline is not None:
+        return _offline
+    return os.environ.get('CANSEER_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
+
+def set_offline(offline=True):
+    """
+    Switches offline mode on or off.
+
+    Parameters
+    ----------
+    - offline : bool or None
+        If True the network is never used and files must already be cached.
+        None restores the CANSEER_OFFLINE environment variable setting.
+    """
+    global _offline
+    _offline = offline
+
+
+def _is_url(source):
+    return urllib.parse.urlparse(os.fspath(source)).scheme in ('http', 'https', 'ftp', 'file')
+
+
+def _index_path():
+    return os.path.join(get_cache_dir(), 'index.json')
+
+
+def _object_path(digest):
+    return os.path.join(get_cache_dir(), 'objects', digest)
+
+
+@contextlib.contextmanager
+def _index_lock():
+    """
+    Holds an exclusive lock on the cache index, shared by the threads and
+    processes using the cache directory. Index updates and object deletes
+    are done under it so concurrent downloads never drop each other's
+    entries or delete an object another download has just indexed.
+    """
+    os.makedirs(get_cache_dir(), exist_ok=True)
+    with open(os.path.join(get_cache_dir(), 'index.lock'), 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                # msvcrt.locking() gives up after 10 seconds of waiting
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _read_index():
+    try:
+        with open(_index_path(), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write_index(index):
+    # Write to a temporary file first so a crash never leaves a broken index
+    os.makedirs(get_cache_dir(), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=get_cache_dir(), suffix='.json')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp_path, _index_path())
+
+
+def _store_response(response):
+    """
+    Streams a response into a .part file of the object store. Returns its
+    path and the sha256 of the content, which the caller renames it to
+    with the index locked.
+    """
+    objects_dir = os.path.join(get_cache_dir(), 'objects')
+    os.makedirs(objects_dir, exist_ok=True)
+    sha = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=objects_dir, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for block in iter(lambda: response.read(1 << 20), b''):
+                sha.update(block)
+                f.write(block)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return tmp_path, sha.hexdigest()
+
+
+@stage('download')
+def cached_download(source, offline=None, revalidate=True):
+    """
+    Returns a local path to the file at source, downloading it only if
+    the cached copy is missing or out of date.
+
+    Files are stored under their sha256 so identical downloads are kept once.
+    A cached file is revalidated with the server through the ETag and
+    Last-Modified headers before it is reused.
+
+    Parameters
+    ----------
+    - source : str
+        URL (http, https, ftp or file) or a local path. Local paths are
+        returned unchanged.
+    - offline : bool, optional
+        If True never use the network. Defaults to is_offline().
+    - revalidate : bool, optional
+        If False a cached copy is used without asking the server.
+        The default is True.
+
+    Raises
+    ------
+    FileNotFoundError
+        If offline and source has not been cached yet.
+
+    Returns
+    -------
+    - path : str
+        Path to the local copy of the file.
+    """
+    if not _is_url(source):
+        return os.fspath(source)
+    if offline is None:
+        offline = is_offline()
+
+    with _index_lock():
+        entry = _read_index().get(source)
+        if entry is not None and not os.path.exists(_object_path(entry['sha256'])):
+            entry = None
+
+    if entry is not None and (offline or not revalidate):
+        return _object_path(entry['sha256'])
+    if offline:
+        raise FileNotFoundError(
+            f'"{source}" is not in the cache at {get_cache_dir()} '
+            'and offline mode is enabled')
+
+    # Ask the server for the file only if it has changed since it was cached
+    request = urllib.request.Request(source)
+    if entry is not None:
+        if entry.get('etag'):
+            request.add_header('If-None-Match', entry['etag'])
+        if entry.get('last_modified'):
+            request.add_header('If-Modified-Since', entry['last_modified'])
+
+    try:
+        response = urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT)
+    except urllib.error.HTTPError as err:
+        if err.code == 304 and entry is not None:
+            return _object_path(entry['sha256'])
+        raise
+
+    with response:
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        # Servers (and file:// URLs) may ignore conditional headers,
+        # so compare the validators ourselves before downloading the body
+        if (entry is not None
+                and (etag or last_modified)
+                and etag == entry.get('etag')
+                and last_modified == entry.get('last_modified')):
+            return _object_path(entry['sha256'])
+        tmp_path, digest = _store_response(response)
+
+    # Re-read the index with the lock held, other downloads may have
+    # updated it since
+    with _index_lock():
+        os.replace(tmp_path, _object_path(digest))
+        index = _read_index()
+        previous = index.get(source)
+        index[source] = {'sha256': digest,
+                         'etag': etag,
+                         'last_modified': last_modified,
+                         'fetched': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        _write_index(index)
+        # Drop the out of date copy unless another URL shares its content
+        if previous is not None and previous['sha256'] != digest:
+            if previous['sha256'] not in {e['sha256'] for e in index.values()}:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(_object_path(previous['sha256']))
+    return _object_path(digest)
+
+
+def invalidate(source=None):
+    """
+    Removes files from the cache so the next cached_download() refetches them.
+
+    Parameters
+    ----------
+    - source : str, optional
+        URL to invalidate. If None the whole cache is cleared.
+    """
+    with _index_lock():
+        index = _read_index()
+        if source is None:
+            index = {}
+        else:
+            index.pop(source, None)
+        _write_index(index)
+        _remove_unreferenced(index)
+
+
+def _remove_unreferenced(index):
+    """Deletes stored objects which no URL in the index points to."""
+    objects_dir = os.path.join(get_cache_dir(), 'objects')
+    if not os.path.isdir(objects_dir):
+        return
+    in_use = {entry['sha256'] for entry in index.values()}
+    for name in os.listdir(objects_dir):
+        if name not in in_use and not name.endswith('.part'):
+            os.remove(os.path.join(objects_dir, name))
@@ -0,0 +1,249 @@
+import functools
+import json
+import os
+import tempfile
+import numpy as np
+from canseer._lazy import LazyModule
+from canseer.data_wrangling import read_icb_sicb_coding
+from canseer.download_cache import get_cache_dir
+from canseer.instrumentation import stage
+from canseer.resources import data_path
+
+# Geospatial libraries are imported on first use
+gpd = LazyModule('geopandas')
+shapely = LazyModule('shapely')
+
+# ONS shapefile of Sub-ICB Locations (SICBLs)
+SICBL_SHAPEFILE = data_path('ons_shapefile',
+                            'Sub_Integrated_Care_Board_Locations_'
+                            + 'April_2023_EN_BGC_-4649276714948222786')
+
+# Tolerances in metres (British National Grid) of the simplified copies
+SIMPLIFY_TOLERANCES = [0, 50, 100, 250, 500, 1000]
+
+# Approximate north-south extent of England in metres, used to work out
+# the size of a pixel on the map
+ENGLAND_EXTENT = 660000
+
+# Map level -> column naming each area, built from the SICBL boundaries
+MAP_LEVELS = {'sicbl': 'SICBL23NM',
+              'icb': 'ICB23NM',
+              'region': 'nhs_region'}
+
+
+def _sicbl_geometry():
+    """SICBL boundaries with the ICB and NHS region each belongs to."""
+    gdf = gpd.read_file(SICBL_SHAPEFILE)
+    lookup = read_icb_sicb_coding()
+
+    parents = (lookup.set_index('SICBL22CD')
+               [['ICB22CD', 'ICB22NM', 'NHSER22NM']]
+               .reindex(gdf['SICBL23CD']))
+
+    # SICBLs created since the 2022 lookup are matched to their ICB through
+    # the name, e.g. 'NHS Kent and Medway ICB - 91Q'
+    icb_short_names = lookup['SICBL22NM'].str.split(' - ').str[0]
+    by_short_name = (lookup.assign(short_name=icb_short_names)
+                     .drop_duplicates('short_name')
+                     .set_index('short_name')
+                     [['ICB22CD', 'ICB22NM', 'NHSER22NM']])
+    missing = parents['ICB22CD'].isna().to_numpy()
+    short_names = gdf['SICBL23NM'].str.split(' - ').str[0][missing]
+    parents.iloc[missing] = by_short_name.reindex(short_names).to_numpy()
+
+    return gdf.assign(icb_code=parents['ICB22CD'].to_numpy(),
+                      ICB23NM=parents['ICB22NM'].to_numpy(),
+                      nhs_region=parents['NHSER22NM'].to_numpy())
+
+
+def _source_modified():
+    return int(max(os.path.getmtime(os.path.join(SICBL_SHAPEFILE, file))
+                   for file in os.listdir(SICBL_SHAPEFILE)))
+
+
+def _read_cached(path):
+    """
+    Returns the GeoParquet boundaries at path, or None if there are none.
+    A file which cannot be read, e.g. one truncated by a crash, is removed
+    so it is written again.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        return gpd.read_parquet(path)
+    except ImportError:
+        # pyarrow is not installed
+        return None
+    except Exception:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+
+def _write_cached(gdf, path):
+    """
+    Writes boundaries to path as GeoParquet. The file is written under a
+    temporary name and then renamed, so readers never see a partial file.
+    If it cannot be written, e.g. the cache directory is read-only or
+    pyarrow is not installed, the boundaries are only kept in memory.
+    """
+    tmp_path = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        os.close(fd)
+        gdf.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@functools.lru_cache(maxsize=None)
+def _geometry(name, tolerance):
+    """
+    Boundaries for one of MAP_LEVELS, parsed, dissolved and simplified
+    once per process. Dissolved and simplified boundaries are also kept in
+    the download cache as GeoParquet, named after the SICBL shapefile's
+    modification time so they follow updates.
+    """
+    if name == 'sicbl' and tolerance == 0:
+        return _sicbl_geometry()
+
+    path = os.path.join(get_cache_dir(), 'geometry',
+                        f'{name}_{tolerance}m_{_source_modified()}.parquet')
+    gdf = _read_cached(path)
+    if gdf is not None:
+        return gdf
+
+    if tolerance == 0:
+        # ICB and region boundaries are dissolved from the SICBLs
+        key = MAP_LEVELS[name]
+        columns = ['icb_code', 'ICB23NM', 'nhs_region'] if name == 'icb' else [key]
+        gdf = (_geometry('sicbl', 0)[columns + ['geometry']]
+               .dissolve(by=key, as_index=False))
+    else:
+        gdf = _geometry(name, 0).copy()
+        gdf['geometry'] = gdf.geometry.simplify(tolerance, preserve_topology=True)
+
+    _write_cached(gdf, path)
+    return gdf
+
+
+def _check_tolerance(tolerance):
+    if tolerance not in SIMPLIFY_TOLERANCES:
+        raise ValueError(f'tolerance should be one of {SIMPLIFY_TOLERANCES}')
+
+
+def icb_geometry(tolerance=0):
+    """
+    Returns the ICB boundaries, dissolved from the SICBL boundaries once
+    per process, as map_geometry('icb').
+
+    Parameters
+    ----------
+    - tolerance : int, optional
+        Simplification tolerance in metres, one of SIMPLIFY_TOLERANCES.
+        0 returns the full resolution boundaries. Simplified copies are
+        saved as GeoParquet in the canseer cache directory (see
+        canseer.download_cache) so later processes can load them quickly.
+        The default is 0.
+
+    Returns
+    -------
+    - gdf : GeoDataFrame
+        One row per ICB, named in the ICB23NM column, with its code
+        (icb_code) and NHS region (nhs_region).
+    """
+    _check_tolerance(tolerance)
+    return _geometry('icb', tolerance).copy()
+
+
+@stage('map_geometry')
+def map_geometry(level='icb', tolerance=0):
+    """
+    Returns boundaries at SICBL, ICB or NHS region level.
+
+    All levels come from the bundled SICBL boundaries. ICBs and regions are
+    dissolved from them once and cached like the simplified copies.
+
+    Parameters
+    ----------
+    - level : str, optional
+        'sicbl', 'icb' or 'region'. The default is 'icb'.
+    - tolerance : int, optional
+        Simplification tolerance in metres, one of SIMPLIFY_TOLERANCES.
+        The default is 0.
+
+    Returns
+    -------
+    - gdf : GeoDataFrame
+        One row per area. The MAP_LEVELS column of the level names the area,
+        'sicbl' and 'icb' rows also name the ICB (ICB23NM) and region
+        (nhs_region) they belong to.
+    """
+    if level not in MAP_LEVELS:
+        raise ValueError(f'level should be one of {list(MAP_LEVELS)}')
+    _check_tolerance(tolerance)
+    return _geometry(level, tolerance).copy()
+
+
+@functools.lru_cache(maxsize=None)
+def _map_geojson(level, tolerance, decimals):
+    gdf = _geometry(level, tolerance).to_crs(epsg=4326)
+    gdf['geometry'] = shapely.transform(gdf.geometry.values,
+                                        lambda coords: np.round(coords, decimals))
+    area = MAP_LEVELS[level]
+    return json.loads(gdf[[area, 'geometry']].set_index(area).to_json(drop_id=False))
+
+
+@stage('map_geojson')
+def map_geojson(level='icb', tolerance=250, decimals=4):
+    """
+    Returns the boundaries of map_geometry() as a GeoJSON dict in
+    longitude/latitude, for web maps such as Plotly.
+
+    The GeoJSON is built once per process for each set of arguments and the
+    same dict is returned each time, so it should not be modified.
+
+    Parameters
+    ----------
+    - level : str, optional
+        'sicbl', 'icb' or 'region'. The default is 'icb'.
+    - tolerance : int, optional
+        Simplification tolerance in metres, one of SIMPLIFY_TOLERANCES.
+        The default is 250, small enough for a map of England.
+    - decimals : int, optional
+        Decimal places kept in the coordinates, 4 is about 10 metres.
+        The default is 4.
+
+    Returns
+    -------
+    - geojson : dict
+        A FeatureCollection. The id of each feature is the area name in the
+        MAP_LEVELS column of the level, e.g. ICB23NM.
+    """
+    if level not in MAP_LEVELS:
+        raise ValueError(f'level should be one of {list(MAP_LEVELS)}')
+    _check_tolerance(tolerance)
+    return _map_geojson(level, tolerance, decimals)
+
+
+def tolerance_for_figure(figsize=(7, 7), dpi=300):
+    """
+    Returns the largest of SIMPLIFY_TOLERANCES smaller than one pixel of
+    a map of England drawn at figsize and dpi, so simplification is not
+    visible in the figure.
+    """
+    pixel = ENGLAND_EXTENT / (min(figsize) * dpi)
+    return max(tol for tol in SIMPLIFY_TOLERANCES if tol <= pixel)
+
+
+def icb_geometry_for_figure(figsize=(7, 7), dpi=300):
+    """
+    Returns the ICB boundaries simplified to the resolution of a figure,
+    see icb_geometry() and tolerance_for_figure().
+    """
+    return icb_geometry(tolerance_for_figure(figsize, dpi))
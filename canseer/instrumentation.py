@@ -0,0 +1,190 @@
+import contextlib
+import functools
+import threading
+import time
+import tracemalloc
+
+# Active instrument() sessions, each receiving a record for every
+# finished stage
+_sessions = []
+
+# tracemalloc.reset_peak() is new in Python 3.9. Without it the peak of a
+# stage cannot be told apart from earlier peaks, so memory is not measured.
+_CAN_RESET_PEAK = hasattr(tracemalloc, 'reset_peak')
+
+# Stages running in each thread, innermost last
+_local = threading.local()
+
+
+class _Session:
+    """
+    An instrument() block: where its records go, the thread which opened
+    it and whether it started tracemalloc, which stages of that thread
+    then use to measure memory.
+    """
+
+    def __init__(self, listener, memory):
+        self.listener = listener
+        self.thread = threading.get_ident()
+        self.memory = memory
+
+
+def _rows(value):
+    """Number of rows of a dataframe-like value, or of the first in a tuple."""
+    if isinstance(value, tuple):
+        for item in value:
+            rows = _rows(item)
+            if rows is not None:
+                return rows
+        return None
+    if hasattr(value, 'shape') and hasattr(value, 'columns'):
+        return value.shape[0]
+    return None
+
+
+class stage:
+    """
+    Times a piece of canseer work while instrument() is active.
+
+    Used as a decorator, rows_in is the row count of the first dataframe
+    argument and rows_out that of the returned dataframe. Used as a context
+    manager the counts can be set on the stage:
+
+    >>> with stage('provider.read_excel') as current:
+    ...     raw = pd.read_excel(path)
+    ...     current.rows_out = len(raw)
+
+    With no active instrument() the cost is one list check.
+    """
+
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _sessions:
+                return func(*args, **kwargs)
+            rows_in = next((rows for rows in map(_rows, args) if rows is not None), None)
+            with stage(self.name, rows_in) as current:
+                result = func(*args, **kwargs)
+                current.rows_out = _rows(result)
+            return result
+        return wrapper
+
+    def __enter__(self):
+        self._active = bool(_sessions)
+        if not self._active:
+            return self
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        thread = threading.get_ident()
+        self._tracing = tracemalloc.is_tracing() and any(
+            session.memory and session.thread == thread for session in list(_sessions))
+        if self._tracing:
+            self._memory_start = tracemalloc.get_traced_memory()[0]
+            # Keep the peak seen so far by the enclosing stage
+            # before resetting it for this one
+            if stack:
+                stack[-1]._child_peak = max(stack[-1]._child_peak,
+                                            tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self._child_peak = 0
+        stack.append(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if not self._active:
+            return False
+        seconds = time.perf_counter() - self._start
+        stack = _local.stack
+        stack.pop()
+
+        peak_bytes = None
+        if self._tracing and tracemalloc.is_tracing():
+            peak = max(tracemalloc.get_traced_memory()[1], self._child_peak)
+            peak_bytes = max(peak - self._memory_start, 0)
+            if stack:
+                stack[-1]._child_peak = max(stack[-1]._child_peak, peak)
+
+        record = {'stage': self.name,
+                  'seconds': seconds,
+                  'rows_in': self.rows_in,
+                  'rows_out': self.rows_out,
+                  'peak_bytes': peak_bytes,
+                  'depth': len(stack),
+                  'thread': threading.current_thread().name,
+                  'error': None if exc_type is None else exc_type.__name__}
+        for session in list(_sessions):
+            session.listener(record)
+        return False
+
+
+@contextlib.contextmanager
+def instrument(callback=None, memory=True):
+    """
+    Records the time, rows and memory of each canseer stage run inside the
+    with block: downloads, Excel parsing, dtype coercion, the select_* and
+    filter_data filters, proportion_breaches, lookups, shapefile reading and
+    figure rendering.
+
+    Parameters
+    ----------
+    - callback : callable, optional
+        Called with each record as its stage finishes, e.g. to send it to a
+        metrics system. Records are also collected in the yielded list.
+    - memory : bool, optional
+        Measure memory with tracemalloc, which slows Python code down.
+        Memory is only measured if this call starts tracemalloc, so a
+        trace started elsewhere keeps its peak, and needs Python 3.9 or
+        later. The default is True.
+
+    Yields
+    ------
+    - records : list of dict
+        One dict per finished stage, in the order they finish, with keys
+        stage : str, the stage name
+        seconds : float, wall time
+        rows_in, rows_out : int or None, rows of the input and output frames
+        peak_bytes : int or None, peak memory allocated above the memory
+            in use at the start of the stage (None without memory)
+        depth : int, number of enclosing stages in the same thread
+        thread : str, name of the thread which ran the stage
+        error : str or None, exception type if the stage failed
+
+    Notes
+    -----
+    Stages run by any thread are recorded, e.g. the downloads load_data()
+    runs in worker threads. Memory is only measured for the stages of the
+    thread which entered the with block, as tracemalloc has one peak for
+    all threads. Stages run in other processes are not recorded.
+
+    Examples
+    --------
+    >>> with instrument() as records:
+    ...     df = get_provider_data()
+    ...     plot_icb_map(df, {'standard': 'FDS'})
+    >>> pd.DataFrame(records)
+    """
+    records = []
+
+    def listener(record):
+        records.append(record)
+        if callback is not None:
+            callback(record)
+
+    started_tracing = memory and _CAN_RESET_PEAK and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    session = _Session(listener, started_tracing)
+    _sessions.append(session)
+    try:
+        yield records
+    finally:
+        _sessions.remove(session)
+        if started_tracing:
+            tracemalloc.stop()
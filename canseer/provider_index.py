@@ -0,0 +1,216 @@
+import numpy as np
+import pandas as pd
+from canseer.data_wrangling import FILTER_COLUMNS, _filter_found, _resolve_filter
+
+
+class ProviderIndex:
+    """
+    Inverted index over the dimensions of a provider dataframe.
+
+    For every value of org_code, standard, cancer_type, treatment_modality,
+    stage_or_route and month the index keeps the sorted row positions where
+    it occurs. A filter query takes the rows of its most selective filter
+    from the index and checks the other filters on those rows only, so it
+    never scans the whole frame.
+
+    Parameters
+    ----------
+    - df : Dataframe
+        Output of get_provider_data() or a frame with the same layout.
+
+    Examples
+    --------
+    >>> index = ProviderIndex(get_provider_data())
+    >>> index.filter({'standard': 'FDS', 'org': ['RWP', 'RXQ']})
+    >>> filter_data(index, {'standard': 'FDS'})  # same as index.filter()
+    """
+
+    def __init__(self, df):
+        self.frame = df
+        # column -> (values, offsets, positions, codes). The rows holding
+        # values[i] are positions[offsets[i]:offsets[i + 1]], in ascending
+        # order, and codes[row] is i + 1 (0 for a missing value).
+        self._postings = {}
+
+        for column in FILTER_COLUMNS.values():
+            if column not in df.columns:
+                continue
+            values = df[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                codes = values.cat.codes.to_numpy()
+                uniques = values.cat.categories
+            else:
+                codes, uniques = pd.factorize(values)
+            self._postings[column] = self._build_postings(codes, uniques)
+
+        # Months are sorted so a month range is a slice of the postings
+        codes, uniques = pd.factorize(df.index, sort=True)
+        self._postings['month'] = self._build_postings(codes, uniques)
+
+    @staticmethod
+    def _build_postings(codes, uniques):
+        # Shift by one so rows with a missing value (-1) form group 0
+        codes = np.asarray(codes, dtype=np.int64) + 1
+        counts = np.bincount(codes, minlength=len(uniques) + 1)
+        offsets = np.concatenate([[0], np.cumsum(counts)])[1:]
+        positions = np.argsort(codes, kind='stable')
+        return uniques, offsets, positions, codes
+
+    def __len__(self):
+        return len(self.frame)
+
+    def values(self, column, rows=None):
+        """
+        Returns the set of values present in a column, or in the rows at
+        positions rows of it.
+        """
+        uniques, offsets, _, codes = self._postings[column]
+        if rows is None:
+            return set(uniques[np.diff(offsets) > 0])
+        present = np.unique(codes[rows])
+        return set(uniques[present[present > 0] - 1])
+
+    def positions(self, column, values):
+        """
+        Returns the sorted row positions holding any of values in column.
+
+        Parameters
+        ----------
+        - column : str
+            Column name, e.g. 'org_code', or 'month'.
+        - values : list
+            Values to look up. Values not in the index are ignored.
+
+        Returns
+        -------
+        - positions : numpy.ndarray
+        """
+        return self._code_positions(column, self._codes(column, values))
+
+    def _code_positions(self, column, codes):
+        _, offsets, positions, _ = self._postings[column]
+        if len(codes) == 1:
+            return positions[offsets[codes[0]]:offsets[codes[0] + 1]]
+        return np.sort(np.concatenate(
+            [positions[offsets[code]:offsets[code + 1]] for code in codes]
+            + [np.empty(0, dtype=positions.dtype)]))
+
+    def _codes(self, column, values):
+        uniques = self._postings[column][0]
+        codes = pd.Index(uniques).get_indexer(list(values))
+        return codes[codes >= 0]
+
+    def _month_codes(self, start_month=None, end_month=None):
+        months = self._postings['month'][0]
+        first = 0 if start_month is None else months.searchsorted(pd.Timestamp(start_month), 'left')
+        last = len(months) if end_month is None else months.searchsorted(pd.Timestamp(end_month), 'right')
+        return np.arange(first, max(first, last))
+
+    def month_positions(self, start_month=None, end_month=None):
+        """Returns the sorted row positions with start_month <= month <= end_month."""
+        codes = self._month_codes(start_month, end_month)
+        if len(codes) == 0:
+            return np.empty(0, dtype=np.int64)
+        _, offsets, positions, _ = self._postings['month']
+        return np.sort(positions[offsets[codes[0]]:offsets[codes[-1] + 1]])
+
+    def _keep_rows(self, rows, column, codes):
+        """Returns the rows of positions rows holding one of the value codes in column."""
+        uniques, _, _, row_codes = self._postings[column]
+        keep_code = np.zeros(len(uniques) + 1, dtype=bool)
+        keep_code[codes + 1] = True
+        return rows[keep_code[row_codes[rows]]]
+
+    def _query_selective(self, filters):
+        """
+        Looks up the rows of the most selective filter and checks the
+        others on those rows only. Returns None if the result might not be
+        the one of validating the filters in order, see query().
+        """
+        # column -> codes of the values to keep
+        wanted = {}
+        if 'start_month' in filters or 'end_month' in filters:
+            wanted['month'] = self._month_codes(filters.get('start_month'),
+                                                filters.get('end_month'))
+
+        for key, column in FILTER_COLUMNS.items():
+            if key not in filters:
+                continue
+            present = self.values(column)
+            if not _filter_found(key, filters[key], present):
+                return None
+            keep = _resolve_filter(self.frame, key, filters[key], present=present)
+            wanted[column] = self._codes(column, keep)
+
+        # Number of rows each filter matches, read from the offsets
+        def n_rows(column):
+            counts = np.diff(self._postings[column][1])
+            return counts[wanted[column]].sum()
+
+        order = sorted(wanted, key=n_rows)
+        first = order[0]
+        if first == 'month':
+            result = self.month_positions(filters.get('start_month'),
+                                          filters.get('end_month'))
+        else:
+            result = self._code_positions(first, wanted[first])
+
+        for column in order[1:]:
+            if len(result) == 0:
+                break
+            result = self._keep_rows(result, column, wanted[column])
+
+        # A kept value in the result passes the filters before it, so it
+        # passes validation in order too
+        for key, column in FILTER_COLUMNS.items():
+            if key in filters and key != 'standard':
+                if not np.isin(wanted[column] + 1, self._postings[column][3][result]).all():
+                    return None
+        return result
+
+    def query(self, filters={}, strict=False):
+        """
+        Returns the sorted row positions matching a filter_data() filters dict.
+
+        Filter values are validated with the same rules as filter_data(),
+        against the rows kept by the filters before them. The rows of the
+        most selective filter are looked up in the index and the other
+        filters are checked on those rows only, unless a value is not in
+        the frame or not in the rows found, in which case the filters are
+        applied in order.
+        """
+        if not any(key in filters for key in ['start_month', 'end_month', *FILTER_COLUMNS]):
+            return np.arange(len(self.frame))
+
+        result = self._query_selective(filters)
+        if result is not None:
+            return result
+
+        # Positions of the rows kept so far, None for every row
+        rows = None
+        if 'start_month' in filters or 'end_month' in filters:
+            rows = self.month_positions(filters.get('start_month'),
+                                        filters.get('end_month'))
+        for key, column in FILTER_COLUMNS.items():
+            if key not in filters:
+                continue
+            present = None if key == 'standard' else self.values(column, rows)
+            keep = _resolve_filter(self.frame, key, filters[key],
+                                   strict=strict, present=present)
+            codes = self._codes(column, keep)
+            if rows is None:
+                rows = self._code_positions(column, codes)
+            else:
+                rows = self._keep_rows(rows, column, codes)
+        return rows
+
+    def filter(self, filters={}, strict=False):
+        """
+        Filters the indexed frame, see filter_data().
+
+        Returns
+        -------
+        - df : Dataframe
+            Rows of the indexed frame matching filters.
+        """
+        return self.frame.iloc[self.query(filters, strict=strict)]
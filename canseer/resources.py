@@ -0,0 +1,152 @@
+import csv
+import functools
+import hashlib
+import importlib.resources
+import os
+import pathlib
+import pickle
+from canseer._lazy import LazyModule
+
+# pandas is only needed to return tables, so setup.py can build the
+# lookup file without it
+pd = LazyModule('pandas')
+
+# Bundled lookup tables: name -> (file under canseer/data, columns kept
+# (None for all), integer columns). Other columns are strings.
+LOOKUP_TABLES = {
+    'etr': ('ods_data/geographic_etr.csv',
+            ['Organisation Code', 'Name', 'National Grouping',
+             'Higher Level Health Geography', 'Postcode'],
+            []),
+    'icb_sicb': ('ons_shapefile/Sub_ICB_Locations_to_Integrated_Care_Boards'
+                 + '_to_NHS_England_(Region)_(July_2022)_Lookup_in_England.csv',
+                 None,
+                 ['ObjectId']),
+}
+
+# Precompiled LOOKUP_TABLES, written next to the CSVs by build_lookups()
+LOOKUPS_FILE = 'lookups.pkl'
+
+# Format of LOOKUPS_FILE, changed if its layout changes
+LOOKUPS_VERSION = 1
+
+
+def data_path(*parts):
+    """
+    Path of a file or directory bundled in canseer/data, found through the
+    installed package rather than the working directory, e.g.
+    data_path('ods_data', 'geographic_etr.csv').
+    """
+    try:
+        root = importlib.resources.files('canseer') / 'data'
+    except AttributeError:
+        # importlib.resources.files() is new in Python 3.9
+        root = pathlib.Path(__file__).parent / 'data'
+    return os.fspath(root.joinpath(*parts))
+
+
+def _sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _read_table_csv(name):
+    """Reads a LOOKUP_TABLES CSV into a dict of column -> list of values."""
+    file, usecols, int_columns = LOOKUP_TABLES[name]
+    # utf-8-sig drops the byte order mark some ONS files start with
+    with open(data_path(*file.split('/')), newline='', encoding='utf-8-sig') as f:
+        rows = csv.reader(f)
+        header = next(rows)
+        columns = {col: [] for col in header}
+        for row in rows:
+            for col, value in zip(header, row):
+                columns[col].append(value)
+
+    if usecols is not None:
+        columns = {col: columns[col] for col in usecols}
+    for col, values in columns.items():
+        # Empty cells are missing values, as pd.read_csv() reads them
+        if col in int_columns:
+            columns[col] = [int(value) for value in values]
+        else:
+            columns[col] = [value if value != '' else float('nan') for value in values]
+    return columns
+
+
+def build_lookups(directory=None):
+    """
+    Precompiles LOOKUP_TABLES into LOOKUPS_FILE, a pickle of plain lists
+    which loads faster than parsing the CSVs and does not depend on the
+    pandas version. Run by setup.py when the package is built, or with
+    python -m canseer.resources in a source checkout.
+
+    Parameters
+    ----------
+    - directory : str, optional
+        Directory to write LOOKUPS_FILE to. Defaults to canseer/data.
+
+    Returns
+    -------
+    - path : str
+        The file written.
+    """
+    tables = {}
+    for name, (file, _, _) in LOOKUP_TABLES.items():
+        tables[name] = {'sha256': _sha256(data_path(*file.split('/'))),
+                        'columns': _read_table_csv(name)}
+
+    path = os.path.join(directory or data_path(), LOOKUPS_FILE)
+    with open(path, 'wb') as f:
+        pickle.dump({'version': LOOKUPS_VERSION, 'tables': tables}, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+@functools.lru_cache(maxsize=None)
+def _compiled_lookups():
+    """Tables of LOOKUPS_FILE, or {} if it is missing or of another version."""
+    try:
+        with open(data_path(LOOKUPS_FILE), 'rb') as f:
+            compiled = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return {}
+    if compiled.get('version') != LOOKUPS_VERSION:
+        return {}
+    return compiled['tables']
+
+
+@functools.lru_cache(maxsize=None)
+def _lookup_frame(name):
+    file = LOOKUP_TABLES[name][0]
+    compiled = _compiled_lookups().get(name)
+    # Use the precompiled table unless the CSV has been edited since
+    if compiled is not None and compiled['sha256'] == _sha256(data_path(*file.split('/'))):
+        columns = compiled['columns']
+    else:
+        columns = _read_table_csv(name)
+    return pd.DataFrame(columns)
+
+
+def lookup_table(name):
+    """
+    Returns a bundled lookup table (see LOOKUP_TABLES) as a dataframe.
+    The table is loaded once per process, from LOOKUPS_FILE if it has been
+    built, otherwise from the CSV, and each call returns a copy.
+
+    Parameters
+    ----------
+    - name : str
+        'etr' (NHS trusts, from geographic_etr.csv) or 'icb_sicb'
+        (Sub-ICB location to ICB and NHS region lookup).
+
+    Returns
+    -------
+    - df : Dataframe
+    """
+    if name not in LOOKUP_TABLES:
+        raise ValueError(f'Lookup table "{name}" is not one of {list(LOOKUP_TABLES)}')
+    return _lookup_frame(name).copy()
+
+
+if __name__ == '__main__':
+    print(build_lookups())
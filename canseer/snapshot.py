@@ -0,0 +1,262 @@
+import itertools
+import os
+import numpy as np
+import pandas as pd
+from canseer.data_wrangling import (PROVIDER_DATA_LINK, PROVIDER_COLUMNS,
+                                    RENAME_COLS, VALUES_CHANGE, RECODE_NAN,
+                                    CATEGORIES, apply_categories, category_dtype)
+from canseer.catalog import (DataCatalog, build_catalog, catalog_from_metadata,
+                             catalog_metadata, get_catalog, register_catalog)
+from canseer.download_cache import cached_download
+
+# File extensions understood by save_snapshot() and load_snapshot()
+SNAPSHOT_FORMATS = {'.parquet': 'parquet',
+                    '.pq': 'parquet',
+                    '.feather': 'feather',
+                    '.arrow': 'feather'}
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError as err:
+        raise ImportError('Snapshots need the pyarrow package: '
+                          'pip install pyarrow') from err
+    return pyarrow
+
+
+def _snapshot_format(path, fmt):
+    if fmt is not None:
+        if fmt not in ('parquet', 'feather'):
+            raise ValueError(f'Snapshot format "{fmt}" is not "parquet" or "feather"')
+        return fmt
+    ext = os.path.splitext(os.fspath(path))[1].lower()
+    if ext not in SNAPSHOT_FORMATS:
+        raise ValueError(f'Cannot tell the snapshot format of "{path}", '
+                         f'use one of {list(SNAPSHOT_FORMATS)} or pass fmt')
+    return SNAPSHOT_FORMATS[ext]
+
+
+def save_snapshot(df, path, fmt=None, row_group_size=65536):
+    """
+    Writes a cleaned provider (or national) dataframe to a columnar file.
+
+    Categorical columns, int32 counts and the month index are kept, so
+    load_snapshot() returns the same frame as get_provider_data() without
+    parsing the Excel workbook again. Rows are written in month order so
+    each Parquet row group covers a short range of months. The frame's
+    catalog (see canseer.catalog) is saved in the file's metadata.
+
+    Parameters
+    ----------
+    - df : Dataframe
+        Output of get_provider_data() or a frame with the same layout.
+    - path : str
+        File to write, '.parquet' or '.feather' (see SNAPSHOT_FORMATS).
+    - fmt : str, optional
+        'parquet' or 'feather'. By default taken from the file extension.
+    - row_group_size : int, optional
+        Number of rows per Parquet row group. The default is 65536.
+
+    Returns
+    -------
+    - path : str
+        The path written.
+    """
+    pa = _import_pyarrow()
+    fmt = _snapshot_format(path, fmt)
+
+    catalog = get_catalog(df) or DataCatalog.from_frame(df)
+    df = df.sort_index(kind='stable').reset_index()
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                           **catalog_metadata(catalog)})
+
+    if fmt == 'parquet':
+        pa.parquet.write_table(table, path, row_group_size=row_group_size)
+    else:
+        # Uncompressed so the file can be memory-mapped without copying
+        pa.feather.write_feather(table, path, compression='uncompressed')
+    return os.fspath(path)
+
+
+def load_snapshot(path, columns=None, filters=None, memory_map=True, fmt=None):
+    """
+    Reads a snapshot written by save_snapshot().
+
+    Parameters
+    ----------
+    - path : str
+        Snapshot file.
+    - columns : list, optional
+        Columns to read, e.g. ['org_code', 'standard', 'breaches', 'total'].
+        The month index is always read. Defaults to all columns.
+    - filters : list, optional
+        Row filters in pyarrow form, e.g.
+        [('standard', '==', '28-day FDS'),
+         ('month', '>=', pd.Timestamp('2022-06-01'))].
+        For Parquet files row groups which cannot match are skipped.
+    - memory_map : bool, optional
+        Memory-map the file instead of reading it into memory.
+        The default is True.
+    - fmt : str, optional
+        'parquet' or 'feather'. By default taken from the file extension.
+
+    Returns
+    -------
+    - df : Dataframe
+        Dataframe indexed by month, as returned by get_provider_data().
+        Its catalog is read from the file when all rows are loaded,
+        otherwise built from the rows read.
+    """
+    pa = _import_pyarrow()
+    fmt = _snapshot_format(path, fmt)
+
+    if columns is not None:
+        columns = ['month'] + [col for col in columns if col != 'month']
+
+    if fmt == 'parquet':
+        table = pa.parquet.read_table(path, columns=columns, filters=filters,
+                                      memory_map=memory_map)
+    else:
+        # Filter before projecting, the filters may use other columns
+        table = pa.feather.read_table(path, memory_map=memory_map)
+        if filters is not None:
+            table = table.filter(pa.parquet.filters_to_expression(filters))
+        if columns is not None:
+            table = table.select(columns)
+
+    # Snapshots written by other versions or sessions may order the
+    # categories differently, recode them to the shared categories
+    df = apply_categories(table.to_pandas().set_index('month'))
+
+    catalog = catalog_from_metadata(table.schema.metadata)
+    if filters is None and catalog is not None and catalog.n_rows == len(df):
+        register_catalog(df, catalog.restrict(df.columns))
+    else:
+        build_catalog(df)
+    return df
+
+
+# Categorical columns of the provider frame
+CATEGORY_COLUMNS = list(CATEGORIES)
+
+# Count columns of the provider frame
+COUNT_COLUMNS = ['total', 'within_standard', 'breaches']
+
+
+def _provider_chunk_table(pa, rows, positions, categories):
+    """
+    Cleans a chunk of raw worksheet rows the same way as get_provider_data()
+    and returns it as a pyarrow table.
+
+    categories maps each categorical column to a dict of value -> code
+    which grows as new values are seen, so codes stay the same across chunks.
+    """
+    columns = list(zip(*rows))
+    arrays = {'month': pa.array(pd.to_datetime(list(columns[positions['PERIOD']])),
+                                type=pa.timestamp('ns'))}
+
+    for raw_name in PROVIDER_COLUMNS[1:]:
+        name = RENAME_COLS[raw_name]
+        values = columns[positions[raw_name]]
+
+        if name in COUNT_COLUMNS:
+            arrays[name] = pa.array(np.asarray(values, dtype=np.int32))
+            continue
+
+        # Recode the unique values of the chunk only, then map back to rows
+        local_codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+        if name in RECODE_NAN and (local_codes == -1).any():
+            uniques = uniques.append(pd.Index([RECODE_NAN[name]]))
+            local_codes = np.where(local_codes == -1, len(uniques) - 1, local_codes)
+        value_change = VALUES_CHANGE.get(name, {})
+        to_code = categories[name]
+        code_map = np.array([to_code.setdefault(value_change.get(value, value), len(to_code))
+                             for value in uniques], dtype=np.int32)
+        codes = np.where(local_codes == -1, -1, code_map[local_codes]).astype(np.int32)
+
+        arrays[name] = pa.DictionaryArray.from_arrays(
+            pa.array(codes, mask=codes == -1),
+            pa.array(list(to_code), type=pa.string()))
+
+    return pa.table(arrays)
+
+
+def ingest_provider_data(path, data_link=PROVIDER_DATA_LINK, chunk_size=50000):
+    """
+    Streams the provider workbook into a Parquet snapshot in row chunks,
+    keeping memory use bounded by the chunk size rather than the sheet size.
+
+    The worksheet is read in openpyxl read-only mode and each chunk gets the
+    RENAME_COLS, VALUES_CHANGE and RECODE_NAN transforms of get_provider_data().
+    Categorical codes are those of the shared categories (see
+    data_wrangling.CATEGORIES), with new values given the next codes,
+    so every chunk shares them.
+    Load the result with load_snapshot(path).
+
+    Parameters
+    ----------
+    - path : str
+        Parquet file to write.
+    - data_link : str, optional
+        URL or local path of the provider workbook.
+        The default is PROVIDER_DATA_LINK.
+    - chunk_size : int, optional
+        Number of worksheet rows cleaned and written at a time.
+        Each chunk becomes one Parquet row group. The default is 50000.
+
+    Raises
+    ------
+    ValueError
+        If the worksheet is missing any of PROVIDER_COLUMNS.
+
+    Returns
+    -------
+    - path : str
+        The path written.
+
+    Notes
+    -----
+    Rows keep the workbook order.
+    """
+    pa = _import_pyarrow()
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(cached_download(data_link),
+                                      read_only=True, data_only=True)
+    writer = None
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = list(next(rows))
+        missing = [col for col in PROVIDER_COLUMNS if col not in header]
+        if missing:
+            raise ValueError(f'Columns {missing} are not in the provider workbook')
+        positions = {col: header.index(col) for col in PROVIDER_COLUMNS}
+        # Start from the shared categories so the file has their codes
+        categories = {col: {value: code for code, value
+                            in enumerate(category_dtype(col).categories)}
+                      for col in CATEGORY_COLUMNS}
+
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            # Skip blank rows, e.g. at the end of the sheet
+            chunk = [row for row in chunk if row[positions['PERIOD']] is not None]
+            if not chunk:
+                continue
+            table = _provider_chunk_table(pa, chunk, positions, categories)
+            if writer is None:
+                writer = pa.parquet.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+        workbook.close()
+
+    if writer is None:
+        raise ValueError('The provider workbook has no data rows')
+    return os.fspath(path)
@@ -0,0 +1,180 @@
+import json
+import os
+import tempfile
+import time
+import pandas as pd
+from canseer.catalog import build_catalog
+from canseer.data_wrangling import (PROVIDER_DATA_LINK, get_provider_data,
+                                    category_dtype)
+from canseer.snapshot import CATEGORY_COLUMNS, save_snapshot, load_snapshot
+
+
+class ProviderStore:
+    """
+    Provider data kept on disk as one Parquet file per month, so several
+    years of extracts can be combined and refreshed without parsing every
+    workbook again.
+
+    Each ingest() adds only the months the store does not have yet. A month
+    range is loaded by reading the files of those months only. Categories
+    are unified across releases: the store records the values of each
+    column and every loaded month uses the shared CategoricalDtypes of
+    data_wrangling.CATEGORIES, so months concatenate without becoming
+    object columns.
+
+    Layout of the directory::
+
+        store.json                   months, their sources and categories
+        month=2022-04/data.parquet   one snapshot per month (see save_snapshot)
+
+    Requires pyarrow.
+
+    Parameters
+    ----------
+    - root : str
+        Directory of the store, created if needed.
+
+    Examples
+    --------
+    >>> store = ProviderStore('provider_store')
+    >>> store.ingest(link_2021_22)
+    >>> store.ingest(link_2022_23)
+    >>> df = store.load('2021-10-01', '2022-09-01')
+    """
+
+    def __init__(self, root):
+        self.root = os.fspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        self._meta_path = os.path.join(self.root, 'store.json')
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                self._meta = json.load(f)
+        else:
+            self._meta = {'months': {},
+                          'categories': {col: [] for col in CATEGORY_COLUMNS}}
+
+    def _write_meta(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._meta, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self._meta_path)
+
+    def _month_path(self, key):
+        return os.path.join(self.root, f'month={key}', 'data.parquet')
+
+    @property
+    def months(self):
+        """Months in the store, in order, as a DatetimeIndex."""
+        return pd.DatetimeIndex(sorted(pd.Timestamp(f'{key}-01')
+                                       for key in self._meta['months']),
+                                name='month')
+
+    def dtypes(self):
+        """Returns column -> CategoricalDtype used for every loaded month."""
+        return {col: category_dtype(col, categories)
+                for col, categories in self._meta['categories'].items()}
+
+    def ingest(self, data=PROVIDER_DATA_LINK, replace=False):
+        """
+        Adds the months of a provider extract which are not in the store.
+
+        Parameters
+        ----------
+        - data : str or Dataframe, optional
+            URL or local path of a provider workbook, read with
+            get_provider_data(), or a frame in that format.
+            The default is PROVIDER_DATA_LINK.
+        - replace : bool, optional
+            Also overwrite months already in the store, e.g. to take in a
+            revised "Final" extract. The default is False.
+
+        Returns
+        -------
+        - months : DatetimeIndex
+            The months written.
+        """
+        if isinstance(data, pd.DataFrame):
+            df, source = data, 'dataframe'
+        else:
+            source = os.fspath(data)
+            df = get_provider_data(source)
+
+        months = df.index.unique().sort_values()
+        keys = months.strftime('%Y-%m')
+        if not replace:
+            is_new = [key not in self._meta['months'] for key in keys]
+            months, keys = months[is_new], keys[is_new]
+        if len(months) == 0:
+            return months
+
+        # Record the values of every month, so months with values outside
+        # the fixed categories still load with one dtype
+        for col in CATEGORY_COLUMNS:
+            values = df[col]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.cat.remove_unused_categories().cat.categories
+            known = self._meta['categories'][col]
+            seen = set(known)
+            known += [value for value in pd.unique(pd.Series(values, dtype=object).dropna())
+                      if value not in seen]
+
+        written = set(months)
+        for month, rows in df.groupby(level=0, sort=True):
+            if month not in written:
+                continue
+            key = month.strftime('%Y-%m')
+            path = self._month_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            save_snapshot(rows, path)
+            self._meta['months'][key] = {
+                'source': source,
+                'rows': len(rows),
+                'ingested': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+        self._write_meta()
+        return months
+
+    def load(self, start_month=None, end_month=None, columns=None):
+        """
+        Reads the months from start_month to end_month, both included, as
+        select_months() would select them.
+
+        Parameters
+        ----------
+        - start_month : str, optional
+            First month, e.g. '2021-04-01'. Defaults to the first in the store.
+        - end_month : str, optional
+            Last month. Defaults to the last in the store.
+        - columns : list, optional
+            Columns to read. Defaults to all columns.
+
+        Returns
+        -------
+        - df : Dataframe
+            Provider dataframe indexed by month, as from get_provider_data(),
+            with the store's categories (see dtypes()).
+        """
+        months = self.months
+        if start_month is not None:
+            months = months[months >= pd.Timestamp(start_month)]
+        if end_month is not None:
+            months = months[months <= pd.Timestamp(end_month)]
+
+        dtypes = self.dtypes()
+        frames = []
+        for key in months.strftime('%Y-%m'):
+            part = load_snapshot(self._month_path(key), columns=columns)
+            frames.append(part.astype({col: dtype for col, dtype in dtypes.items()
+                                       if col in part.columns}))
+        if not frames:
+            if len(self.months) == 0:
+                raise ValueError(f'The provider store at {self.root} is empty')
+            # Keep the columns and dtypes for an empty range
+            first = load_snapshot(self._month_path(self.months.strftime('%Y-%m')[0]),
+                                  columns=columns)
+            df = first.iloc[:0].astype({col: dtype for col, dtype in dtypes.items()
+                                        if col in first.columns})
+        else:
+            df = pd.concat(frames)
+        build_catalog(df)
+        return df
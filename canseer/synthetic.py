@@ -0,0 +1,203 @@
+import numpy as np
+import pandas as pd
+from canseer.catalog import build_catalog
+from canseer.data_wrangling import (PROVIDER_COLUMNS, RENAME_COLS, VALUES_CHANGE,
+                                    RECODE_NAN, STANDARD_DICT, CATEGORIES,
+                                    nhs_code_link, category_dtype)
+
+# Tumour groups of the 31 and 62-day standards, as in the provider workbook
+TUMOUR_TYPES = ['Breast', 'Gynaecological', 'Haematological', 'Head & Neck',
+                'Lower Gastrointestinal', 'Lung', 'Other (a)', 'Skin',
+                'Upper Gastrointestinal', 'Urological', 'Missing or Invalid',
+                'ALL CANCERS']
+
+# Treatment modalities of the 31 and 62-day standards
+TREATMENT_MODALITIES = ['Anti-cancer drug regimen', 'Other', 'Radiotherapy',
+                        'Surgery', 'ALL MODALITIES']
+
+# Suspected cancer types of the 28-day FDS urgent referral route
+SUSPECTED_TYPES = [value for value in VALUES_CHANGE['cancer_type']
+                   if value.startswith('Suspected ')] + ['Missing or Invalid']
+
+# Combinations of (stage/route, treatment modality, cancer type) in the
+# provider workbook for each standard, with the workbook's raw labels.
+# The 28-day FDS has no treatment modality.
+STANDARD_SCHEMA = {
+    '28-day FDS': (
+        [('URGENT SUSPECTED CANCER', None, cancer) for cancer in SUSPECTED_TYPES]
+        + [('BREAST SYMPTOMATIC, CANCER NOT SUSPECTED', None,
+            'Exhibited (non-cancer) breast symptoms - cancer not initially suspected')]
+        + [('NATIONAL SCREENING PROGRAMME', None, cancer)
+           for cancer in ['Suspected breast cancer',
+                          'Suspected gynaecological cancer',
+                          'Suspected lower gastrointestinal cancer']]),
+    '31-day Combined': [(stage, modality, cancer)
+                        for stage in ['First Treatment', 'Subsequent Treatment']
+                        for modality in TREATMENT_MODALITIES
+                        for cancer in TUMOUR_TYPES],
+    '62-day Combined': [(route, modality, cancer)
+                        for route in ['Urgent Suspected Cancer', 'Breast Symptomatic',
+                                      'Screening', 'Consultant Upgrade']
+                        for modality in TREATMENT_MODALITIES
+                        for cancer in TUMOUR_TYPES],
+}
+
+# Mean proportion of breaches of each standard, keyed as in filter_data()
+BREACH_RATES = {'FDS': 0.27, 'DTT': 0.09, 'RTT': 0.38}
+
+# Most rows an Excel worksheet can hold below the header
+EXCEL_MAX_ROWS = 1048575
+
+
+def _clean_provider_frame(raw):
+    """
+    Applies the transforms of get_provider_data() to a raw provider frame
+    (PROVIDER_COLUMNS, one row per workbook row) without Excel.
+    The categorical columns get the shared categories, as in
+    get_provider_data().
+    """
+    df = (raw.set_index('PERIOD')
+          .rename(columns=RENAME_COLS)
+          .astype({'total': np.int32,
+                   'within_standard': np.int32,
+                   'breaches': np.int32})
+          .fillna(value=RECODE_NAN))
+
+    for column in CATEGORIES:
+        raw_codes, raw_labels = pd.factorize(df[column], sort=True)
+        renamed = [VALUES_CHANGE.get(column, {}).get(label, label) for label in raw_labels]
+        dtype = category_dtype(column, renamed)
+        code_map = dtype.categories.get_indexer(renamed)
+        df[column] = pd.Categorical.from_codes(code_map[raw_codes], dtype=dtype)
+
+    df.index.name = 'month'
+    return df
+
+
+def synthetic_provider_data(n_months=12, n_orgs=None, n_rows=None,
+                            start_month='2022-04-01', breach_rates=BREACH_RATES,
+                            org_variation=20, mean_total=20, seed=0,
+                            xlsx_path=None):
+    """
+    Generates a provider dataframe with the schema of get_provider_data(),
+    for working offline or at a larger scale than the real data.
+
+    Rows are combinations of month, NHS trust (org codes from
+    geographic_etr.csv) and the standard, stage/route, treatment modality and
+    cancer type combinations of the provider workbook (STANDARD_SCHEMA).
+    Categories, dtypes and the month index are those get_provider_data()
+    gives for the same rows.
+
+    Parameters
+    ----------
+    - n_months : int, optional
+        Number of consecutive months. The default is 12.
+    - n_orgs : int, optional
+        Number of trusts, taken in org code order. The default is None
+        (every trust in geographic_etr.csv).
+    - n_rows : int, optional
+        Number of rows. By default every month, trust and combination has
+        one row. Fewer rows are sampled from those combinations, more rows
+        repeat combinations.
+    - start_month : str, optional
+        First month. The default is '2022-04-01'.
+    - breach_rates : dict, optional
+        Mean proportion of breaches for 'FDS', 'DTT' and 'RTT'.
+        The default is BREACH_RATES.
+    - org_variation : float, optional
+        Concentration of the Beta distribution the breach rate of each trust
+        and standard is drawn from, lower values give more variation between
+        trusts. The default is 20.
+    - mean_total : float, optional
+        Mean number of referrals per row. Trust sizes vary around it and
+        every row has a total of at least 1. The default is 20.
+    - seed : int, optional
+        Seed of the random number generator. The default is 0.
+    - xlsx_path : str, optional
+        If given, also write the rows as a provider workbook, with the raw
+        column names and labels, which get_provider_data(xlsx_path) reads
+        back as the returned frame.
+
+    Raises
+    ------
+    ValueError
+        If n_orgs is more than the number of trusts, or the workbook would
+        have more rows than Excel allows.
+
+    Returns
+    -------
+    - df : Dataframe
+        Provider dataframe indexed by month.
+
+    Examples
+    --------
+    >>> df = synthetic_provider_data(n_months=36)  # 3 years, all trusts
+    >>> df = synthetic_provider_data(n_orgs=20, n_rows=5000,
+    ...                              xlsx_path='provider.xlsx')
+    """
+    rng = np.random.default_rng(seed)
+
+    orgs = np.sort(nhs_code_link()['ORG_CODE'].unique())
+    if n_orgs is not None:
+        if n_orgs > len(orgs):
+            raise ValueError(f'n_orgs is {n_orgs}, there are {len(orgs)} trusts')
+        orgs = orgs[:n_orgs]
+    months = pd.date_range(start_month, periods=n_months, freq='MS')
+
+    combos = pd.DataFrame(
+        [(standard, *combo) for standard, combos in STANDARD_SCHEMA.items()
+         for combo in combos],
+        columns=['STANDARD', 'STAGE/ROUTE', 'TREATMENT MODALITY', 'CANCER TYPE'])
+
+    # Rows index the grid of month x org x combination
+    grid = (len(months), len(orgs), len(combos))
+    grid_size = int(np.prod(grid))
+    if n_rows is None:
+        rows = np.arange(grid_size)
+    else:
+        rows = np.sort(rng.choice(grid_size, n_rows, replace=n_rows > grid_size))
+    month_idx, org_idx, combo_idx = np.unravel_index(rows, grid)
+
+    # Trust sizes and breach rates for each trust and standard
+    standards = list(STANDARD_DICT.values())
+    org_size = rng.lognormal(0, 0.5, len(orgs))
+    mean_rates = np.array([breach_rates[key] for key in STANDARD_DICT])
+    org_rates = rng.beta(mean_rates * org_variation, (1 - mean_rates) * org_variation,
+                         size=(len(orgs), len(standards)))
+    standard_idx = pd.Index(standards).get_indexer(combos['STANDARD'])[combo_idx]
+
+    total = rng.poisson(mean_total * org_size[org_idx]) + 1
+    breaches = rng.binomial(total, org_rates[org_idx, standard_idx])
+
+    raw = combos.iloc[combo_idx].reset_index(drop=True)
+    raw.insert(0, 'PERIOD', months[month_idx])
+    raw['ORG CODE'] = orgs[org_idx]
+    raw['TOTAL'] = total
+    raw['WITHIN STANDARD'] = total - breaches
+    raw['BREACHES'] = breaches
+    raw = raw[PROVIDER_COLUMNS]
+
+    if xlsx_path is not None:
+        _write_provider_workbook(raw, xlsx_path)
+    df = _clean_provider_frame(raw)
+    build_catalog(df)
+    return df
+
+
+def _write_provider_workbook(raw, path):
+    """Streams raw provider rows to an Excel workbook."""
+    import openpyxl
+
+    if len(raw) > EXCEL_MAX_ROWS:
+        raise ValueError(f'{len(raw)} rows do not fit in an Excel worksheet '
+                         f'(at most {EXCEL_MAX_ROWS})')
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Provider')
+    sheet.append(PROVIDER_COLUMNS)
+    # Timestamps are datetimes, so openpyxl writes them as Excel dates
+    columns = [raw[column].astype(object).where(raw[column].notna(), None).to_numpy()
+               for column in PROVIDER_COLUMNS]
+    for row in zip(*columns):
+        sheet.append(row)
+    workbook.save(path)
+    return path
@@ -0,0 +1,212 @@
+import functools
+import re
+import numpy as np
+import pandas as pd
+from canseer.resources import data_path, lookup_table
+
+# NHS trust names and organisation codes, from NHS Digital ODS
+ETR_PATH = data_path('ods_data', 'geographic_etr.csv')
+
+# Abbreviations expanded before names are compared
+ABBREVIATIONS = {'ft': 'foundation trust',
+                 'nhsft': 'nhs foundation trust',
+                 'univ': 'university',
+                 'uni': 'university',
+                 'hosp': 'hospital',
+                 'hosps': 'hospitals',
+                 'tr': 'trust'}
+
+# Words most trust names share, left out of the fuzzy index
+STOP_WORDS = {'nhs', 'foundation', 'trust', 'the', 'of', 'and'}
+
+
+def normalise_name(name):
+    """
+    Lower case name with '&' as 'and', punctuation removed and
+    ABBREVIATIONS expanded, e.g. "St George's Univ. Hosps NHS FT" ->
+    'st georges university hospitals nhs foundation trust'.
+    """
+    name = name.lower().replace('&', ' and ').replace("'", '')
+    words = re.sub(r'[^a-z0-9]+', ' ', name).split()
+    return ' '.join(ABBREVIATIONS.get(word, word) for word in words)
+
+
+def _trigrams(normalised):
+    """Padded 3-grams of the words of a normalised name, less STOP_WORDS."""
+    grams = set()
+    for word in normalised.split():
+        if word in STOP_WORDS:
+            continue
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrustDirectory:
+    """
+    NHS trust names and organisation codes, indexed for exact and fuzzy
+    lookups.
+
+    Names are matched after normalise_name(), so case, punctuation, '&'
+    and common abbreviations do not matter. For names which do not match
+    exactly, search() ranks trusts by the trigrams their names share with
+    the query, leaving out words every trust shares such as 'NHS' and
+    'Foundation Trust'. A trigram index holds the trusts of each trigram,
+    so a query only counts the trigrams of trusts sharing one with it.
+
+    Parameters
+    ----------
+    - codes : list of str
+        Organisation codes.
+    - names : list of str
+        Trust names, in the order of codes.
+
+    Examples
+    --------
+    >>> trusts = trust_directory()
+    >>> trusts.code('Manchester University NHS Foundation Trust')
+    'R0A'
+    >>> trusts.search('Manchestr Univ', limit=2)
+    [('R0A', 'MANCHESTER UNIVERSITY NHS FOUNDATION TRUST', 0.894), ...]
+    >>> trusts.resolve(referrals['trust'])  # Series of codes
+    """
+
+    def __init__(self, codes, names):
+        if len(codes) != len(names):
+            raise ValueError(f'{len(codes)} codes and {len(names)} names given')
+        self.codes = list(codes)
+        self.names = list(names)
+        self._name_of_code = dict(zip(self.codes, self.names))
+        self._code_of_name = {normalise_name(name): code
+                              for code, name in zip(self.codes, self.names)}
+
+        # trigram -> positions of the trusts whose name has it
+        postings = {}
+        self._n_grams = np.zeros(len(self.names), dtype=np.int64)
+        for position, name in enumerate(self.names):
+            grams = _trigrams(normalise_name(name))
+            self._n_grams[position] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(position)
+        self._postings = {gram: np.array(positions, dtype=np.int64)
+                          for gram, positions in postings.items()}
+        # Position of each trust in name order, to break ties
+        self._name_rank = np.argsort(np.argsort(self.names, kind='stable'))
+
+        # (normalised query, min_score) -> code or None, filled by resolve()
+        self._resolved = {}
+
+    @classmethod
+    def from_csv(cls, path=ETR_PATH):
+        """Reads the directory from an ODS trust file such as geographic_etr.csv."""
+        df = pd.read_csv(path, usecols=['Organisation Code', 'Name'])
+        return cls(df['Organisation Code'], df['Name'])
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, name):
+        return normalise_name(name) in self._code_of_name
+
+    def code(self, name):
+        """Returns the organisation code of a trust name, or None if not found."""
+        return self._code_of_name.get(normalise_name(name))
+
+    def name(self, code):
+        """Returns the trust name of an organisation code, or None if not found."""
+        return self._name_of_code.get(code)
+
+    def to_dict(self, title=True):
+        """
+        Returns a dict of trust name -> organisation code, with the names
+        in title case as name_org_code() gives them if title is True.
+        """
+        if title:
+            return {name.title(): code for code, name in zip(self.codes, self.names)}
+        return dict(zip(self.names, self.codes))
+
+    def search(self, query, limit=5, min_score=0.3):
+        """
+        Returns the trusts whose names are most similar to query.
+
+        Parameters
+        ----------
+        - query : str
+            Full, partial or misspelt trust name.
+        - limit : int, optional
+            Most trusts returned. The default is 5.
+        - min_score : float, optional
+            Least similarity, from 0 to 1, of a returned trust.
+            The default is 0.3.
+
+        Returns
+        -------
+        - matches : list of tuples
+            (org_code, name, score) in descending score order. An exact
+            match scores 1.
+
+        Notes
+        -----
+        The score is the mean of the Dice coefficient of the trigrams of
+        the two names and the share of the query's trigrams found in the
+        trust name, so a partial name ranks the trusts containing it first.
+        """
+        normalised = normalise_name(query)
+        exact = self._code_of_name.get(normalised)
+        if exact is not None:
+            return [(exact, self._name_of_code[exact], 1.0)]
+
+        grams = _trigrams(normalised)
+        hits = [self._postings[gram] for gram in grams if gram in self._postings]
+        if not hits:
+            return []
+        shared = np.bincount(np.concatenate(hits), minlength=len(self.names))
+        dice = 2 * shared / (len(grams) + self._n_grams)
+        scores = (dice + shared / len(grams)) / 2
+
+        candidates = np.flatnonzero(scores >= min_score)
+        # Highest score first, ties in name order
+        order = np.lexsort((self._name_rank[candidates], -scores[candidates]))
+        return [(self.codes[i], self.names[i], round(float(scores[i]), 3))
+                for i in candidates[order][:limit]]
+
+    def resolve(self, names, min_score=0.6):
+        """
+        Returns the organisation code of each of a list of free-text trust
+        names, taking the best search() match. Each distinct name is only
+        looked up once, and the results are kept for later calls.
+
+        Parameters
+        ----------
+        - names : list or Series of str
+            Trust names, e.g. a column of a referral spreadsheet.
+        - min_score : float, optional
+            Least similarity accepted for a name without an exact match.
+            The default is 0.6.
+
+        Returns
+        -------
+        - codes : Series
+            Organisation code of each name, None where no trust matched.
+            Has the index of names if it is a Series.
+        """
+        index = names.index if isinstance(names, pd.Series) else None
+        codes, uniques = pd.factorize(pd.Series(names, dtype=object))
+
+        resolved = []
+        for name in uniques:
+            key = (normalise_name(name), min_score)
+            if key not in self._resolved:
+                matches = self.search(name, limit=1, min_score=min_score)
+                self._resolved[key] = matches[0][0] if matches else None
+            resolved.append(self._resolved[key])
+
+        lookup = np.array(resolved + [None], dtype=object)
+        return pd.Series(lookup[codes], index=index, name='org_code')
+
+
+@functools.lru_cache(maxsize=None)
+def trust_directory():
+    """Returns the TrustDirectory of geographic_etr.csv, read once per process."""
+    trusts = lookup_table('etr')
+    return TrustDirectory(trusts['Organisation Code'], trusts['Name'])
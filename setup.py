@@ -1,4 +1,20 @@
+import os
+import sys
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
+
+
+class build_py_with_lookups(build_py):
+    """Also precompiles the bundled lookup tables, see canseer.resources."""
+
+    def run(self):
+        super().run()
+        if self.dry_run:
+            return
+        # canseer.resources only needs the standard library to build them
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from canseer.resources import build_lookups
+        build_lookups(os.path.join(self.build_lib, 'canseer', 'data'))
 
 
 setup(
@@ -6,6 +22,14 @@ setup(
     version="0.1.3",
     description="A Python package simplifying workflow with NHS Cancer data",
     packages=find_packages(),
+    package_data={
+        "canseer": [
+            "data/ods_data/*.csv",
+            "data/ons_shapefile/*.csv",
+            "data/ons_shapefile/*/*",
+        ]
+    },
+    cmdclass={"build_py": build_py_with_lookups},
     classifiers=[
         "Development Status :: 4 - Beta",
         "License :: OSI Approved :: MIT License",
@@ -16,4 +40,4 @@ setup(
     ],
     python_requires=">=3.6",
     url = "https://github.com/ploginovic/hpdm139_A2"
-)
\ No newline at end of file
+)
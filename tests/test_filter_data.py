@@ -0,0 +1,107 @@
+"""
+filter_data() must give the rows, errors and messages of applying the
+select_* functions one after another, as it did before filters were
+compiled into one mask. Checked on synthetic data, on a frame with a
+catalog, one without and a ProviderIndex.
+"""
+import pandas as pd
+import pytest
+
+from canseer import data_wrangling as dw
+from canseer.catalog import get_catalog
+from canseer.provider_index import ProviderIndex
+from canseer.synthetic import synthetic_provider_data
+
+
+def sequential_filter(df, filters, strict=False):
+    """filter_data() as it was: each filter applied to the rows left by the one before."""
+    if 'start_month' in filters:
+        df = df.loc[df.index >= filters['start_month']]
+    if 'end_month' in filters:
+        df = df.loc[df.index <= filters['end_month']]
+    if 'standard' in filters:
+        df = dw.select_standard(df, filters['standard'], strict=strict)
+    if 'org' in filters:
+        df = dw.select_org(df, filters['org'], strict=strict)
+    if 'stage_or_route' in filters:
+        df = dw.select_stage_or_route(df, filters['stage_or_route'], strict=strict)
+    if 'treatment' in filters:
+        df = dw.select_treatment_modality(df, filters['treatment'], strict=strict)
+    if 'cancer_type' in filters:
+        df = dw.select_cancer(df, filters['cancer_type'], strict=strict)
+    return df
+
+
+@pytest.fixture(scope='module')
+def frames():
+    df = synthetic_provider_data(n_orgs=6, n_rows=3000, seed=0)
+    plain = df.copy()
+    assert get_catalog(df) is not None and get_catalog(plain) is None
+    return {'catalog': df, 'plain': plain, 'index': ProviderIndex(df)}
+
+
+@pytest.fixture(scope='module')
+def cases(frames):
+    df = frames['plain']
+    orgs = sorted(df['org_code'].unique())
+    # A cancer type in the frame which orgs[0] never reports for DTT
+    kept = sequential_filter(df, {'standard': 'DTT', 'org': orgs[0]})
+    filtered_out = sorted(set(df['cancer_type']) - set(kept['cancer_type']))[0]
+    cancer_types = sorted(kept['cancer_type'].unique())
+    return {
+        'standard': {'standard': 'FDS'},
+        'months': {'start_month': '2022-06-01', 'end_month': '2022-09-01'},
+        'all keys': {'start_month': '2022-05-01', 'end_month': '2023-01-01',
+                     'standard': ['FDS', 'DTT', 'RTT'], 'org': orgs[:3],
+                     'stage_or_route': sorted(df['stage_or_route'].unique())[:3],
+                     'treatment': sorted(df['treatment_modality'].unique())[:4],
+                     'cancer_type': cancer_types},
+        'lower case org': {'standard': 'RTT', 'org': [orgs[1].lower()]},
+        'absent in list': {'standard': 'DTT', 'org': [orgs[0], 'ZZZ'],
+                           'cancer_type': ['Not_a_cancer', cancer_types[0]]},
+        'absent single': {'standard': 'DTT', 'org': 'ZZZ'},
+        'bad standard': {'standard': ['FDS', 'XXX'], 'org': orgs[:2]},
+        'filtered out single': {'standard': 'DTT', 'org': orgs[0],
+                                'cancer_type': filtered_out},
+        'filtered out in list': {'standard': 'DTT', 'org': orgs[0],
+                                 'cancer_type': [filtered_out, cancer_types[0]]},
+        'no months left': {'start_month': '2023-01-01', 'end_month': '2022-01-01',
+                           'standard': 'FDS', 'org': [orgs[0]]},
+    }
+
+
+def _run(func, capsys):
+    """Returns func()'s result, or the ValueError it raised, and the lines it printed."""
+    try:
+        result = func()
+    except ValueError as error:
+        result = error
+    return result, capsys.readouterr().out.splitlines()
+
+
+@pytest.mark.parametrize('target', ['catalog', 'plain', 'index'])
+@pytest.mark.parametrize('strict', [False, True])
+@pytest.mark.parametrize('case', ['standard', 'months', 'all keys', 'lower case org',
+                                  'absent in list', 'absent single', 'bad standard',
+                                  'filtered out single', 'filtered out in list',
+                                  'no months left'])
+def test_filter_data_matches_sequential_selects(frames, cases, target, strict, case, capsys):
+    filters = cases[case]
+    expected, expected_out = _run(
+        lambda: sequential_filter(frames['plain'], filters, strict=strict), capsys)
+    result, out = _run(
+        lambda: dw.filter_data(frames[target], filters, strict=strict), capsys)
+
+    if isinstance(expected, ValueError):
+        assert isinstance(result, ValueError)
+        return
+    assert not isinstance(result, ValueError), result
+    pd.testing.assert_frame_equal(result, expected)
+    # One message per value skipped
+    assert len(out) == len(expected_out)
+
+
+def test_filtered_out_value_raises(frames, cases):
+    for df in frames.values():
+        with pytest.raises(ValueError):
+            dw.filter_data(df, cases['filtered out single'])